@@ -3,11 +3,14 @@
 
 from griml.convert import raster_to_vector
 import glob, os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 __all__ = ["convert"]
 
-def convert(indir, proj, band_info, startdate, enddate, outdir=None, overwrite=False):
+def convert(indir, proj, band_info, startdate, enddate, outdir=None,
+            overwrite=False, window_size=None, halo=32, workers=None,
+            min_area=None, margin_buffer=None, ext=".gpkg"):
     """Compile features from multiple processings into one geodataframe
 
     Parameters
@@ -26,33 +29,86 @@ def convert(indir, proj, band_info, startdate, enddate, outdir=None, overwrite=F
         Output file location as string
     overwrite : bool, optional
         Flag to overwrite existing file
+    window_size : int, optional
+        Size (in pixels) of the windows to polygonize each raster in. If None,
+        each band is read whole
+    halo : int, optional
+        Overlap (in pixels) read around each window
+    workers : int, optional
+        Number of worker processes to convert files with. If greater than 1,
+        files that fail to convert are reported and returned as None, and
+        if outdir is given the output file paths are returned instead of
+        the converted vectors
+    min_area : float, optional
+        Threshold area (sq km) below which features are removed from each
+        raster before polygonization
+    margin_buffer : str or geopandas.GeoDataFrame, optional
+        Margin buffer to rasterize onto each raster grid. Features not
+        touching the buffer are removed before polygonization
+    ext : str, optional
+        Output file extension, setting the output format (e.g. ".gpkg" or
+        ".parquet")
 
     Returns
     -------
-    all_gdf : geopandas.dataframe.GeoDataFrame
-        Compiled goedataframe
+    converted : list
+        Converted geodataframes (or output file paths), in input order
     """
     
     # Iterate through files
+    if workers is None or workers < 2:
+        converted=[]
+        count=1
+        for i in indir:
+            print("\n"+str(count) + ". Converting " + str(Path(i).name))
+            g = convert_file(str(i), proj, band_info, startdate, enddate,
+                             outdir, overwrite, window_size, halo,
+                             min_area, margin_buffer, ext)
+            converted.append(g)
+            count=count+1
+        return (converted)
+
+    # Or distribute files across worker processes, which write their own
+    # outputs so only file paths need to be passed back
     converted=[]
-    count=1
-    for i in indir:
-        print("\n"+str(count) + ". Converting " + str(Path(i).name))
-        
-        # Convert raster to vector
-        if outdir is not None:
-            outfile = str(Path(outdir).joinpath(Path(i).stem+".gpkg"))
-            g = raster_to_vector(str(i), proj, band_info, startdate, enddate, outfile, overwrite)
-            print("Saved to "+str(Path(outfile)))
-            
-        else:
-            g = raster_to_vector(str(i), proj, band_info, startdate, enddate)
-        
-        converted.append(g)
-        count=count+1
-        
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(convert_file, str(i), proj, band_info,
+                               startdate, enddate, outdir, overwrite,
+                               window_size, halo, min_area, margin_buffer,
+                               ext, outdir is not None)
+                   for i in indir]
+        for count, (i, f) in enumerate(zip(indir, futures), start=1):
+            try:
+                g = f.result()
+                print("\n"+str(count) + ". Converted " + str(Path(i).name))
+            except Exception as e:
+                print("\n"+str(count) + ". Failed to convert " +
+                      str(Path(i).name) + ": " + str(e))
+                g = None
+            converted.append(g)
+
     return (converted)
-    
+
+def convert_file(infile, proj, band_info, startdate, enddate, outdir=None,
+                 overwrite=False, window_size=None, halo=32, min_area=None,
+                 margin_buffer=None, ext=".gpkg", return_path=False):
+    """Convert a single raster file, returning either the converted vectors
+    or the output file path"""
+    if outdir is not None:
+        outfile = str(Path(outdir).joinpath(Path(infile).stem+ext))
+        g = raster_to_vector(infile, proj, band_info, startdate, enddate,
+                             outfile, overwrite, window_size, halo,
+                             min_area=min_area, margin_buffer=margin_buffer)
+        print("Saved to "+str(Path(outfile)))
+        if return_path:
+            return outfile
+
+    else:
+        g = raster_to_vector(infile, proj, band_info, startdate, enddate,
+                             window_size=window_size, halo=halo,
+                             min_area=min_area, margin_buffer=margin_buffer)
+    return g
+
 if __name__ == "__main__":
     import griml
     infile = os.path.join(os.path.dirname(griml.__file__),"test/test_north_greenland.tif")
@@ -1,17 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 import rasterio as rio
-from shapely.geometry import shape
-from rasterio.features import shapes
+from rasterio.features import shapes, rasterize
+from rasterio.windows import Window
+from rasterio import windows
+from rasterio.transform import Affine
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy import ndimage
+import shapely
+import numpy as np
 import geopandas as gpd
-import pandas as pd
-import os
+from griml.load import load, write
 __all__ = ["raster_to_vector"]
 
-def raster_to_vector(infile, proj, band_info, startdate, enddate, outfile=None, overwrite=False):
+def raster_to_vector(infile, proj, band_info, startdate, enddate, outfile=None,
+                     overwrite=False, window_size=None, halo=32, threads=None,
+                     min_area=None, margin_buffer=None):
     """Convert raster to vector file with geopandas
-    
+
     Parameters
     ----------
     infile : str
@@ -21,74 +32,331 @@ def raster_to_vector(infile, proj, band_info, startdate, enddate, outfile=None,
     band_info : list
         Band information
     startdate : str
-        Start date 
+        Start date
     enddate : str
         End date
      outfile : str, optional
          Output file location as string
     overwrite : bool, optional
         Flag to overwrite existing file
-         
+    window_size : int, optional
+        Size (in pixels) of the windows to read and polygonize the raster in,
+        rounded up to the raster's block size. If None, each band is read and
+        polygonized whole
+    halo : int, optional
+        Overlap (in pixels) read around each window. Polygons smaller than
+        the halo are completed within a window and need no stitching
+    threads : int, optional
+        Number of threads to polygonize bands with. Defaults to one thread
+        per band
+    min_area : float, optional
+        Threshold area (sq km) below which features are removed from the
+        raster before polygonization, matching griml.filter.filter_area
+    margin_buffer : str or geopandas.GeoDataFrame, optional
+        Margin buffer to rasterize onto the raster grid. Features not touching
+        the buffer are removed before polygonization, matching
+        griml.filter.filter_margin up to pixel-edge effects
+
     Returns
     -------
     all_gdf : geopandas.GeoDataFrame
         Converted vectors geodataframe
     """
     # Get vectors from bands
-    dfs=[]
-    for b in band_info:
-        print("Retrieving vectors from band " + str(b["source"]) + "...")
-        p = get_band_vectors(infile, b["b_number"])
-        df = pd.DataFrame({"geometry": p,
-                           "method": b["method"],
-                           "source": b["source"],
-                           "startdate": startdate,
-                           "enddate": enddate})
-        dfs.append(df)
-            
+    print("Retrieving vectors from bands " +
+          ", ".join([str(b["source"]) for b in band_info]) + "...")
+    polys = get_bands_vectors(infile, [b["b_number"] for b in band_info],
+                              window_size, halo, threads, min_area,
+                              margin_buffer)
+
     # Merge into single geodataframe
-    all_gdf = pd.concat(dfs, ignore_index=True)
-    all_gdf = gpd.GeoDataFrame(all_gdf,
-                               geometry=all_gdf.geometry,
-                               crs=proj)
-    
+    counts = [len(p) for p in polys]
+    all_gdf = gpd.GeoDataFrame(
+        {"geometry": np.concatenate(polys),
+         "method": np.repeat([b["method"] for b in band_info], counts),
+         "source": np.repeat([b["source"] for b in band_info], counts),
+         "startdate": startdate,
+         "enddate": enddate},
+        geometry="geometry",
+        crs=proj)
+
     # Assign compatible index
     all_gdf["row_id"] = all_gdf.index + 1
     # all_gdf = all_gdf.reset_index(drop=False, inplace=False)
-    all_gdf = all_gdf.set_index("row_id") 
+    all_gdf = all_gdf.set_index("row_id")
 
     # Save and return
     if outfile is not None:
-        if os.path.isfile(outfile):
-            if overwrite:
-                print("Overwriting existing file")
-                all_gdf.to_file(outfile)
-                print("Overwritten file saved to " + str(outfile))
-            else:
-                print("File exists and will not be overwritten. Moving to next file")
-        else:
-            print("Writing new file")
-            all_gdf.to_file(outfile)
-            print("New file saved to " + str(outfile))
+        write(all_gdf, outfile, overwrite)
 
     return all_gdf
 
 
-def get_band_vectors(infile, band):
-    """Read raster band and extract shapes as polygon vectors"""
-    mask = None
+def get_band_vectors(infile, band, window_size=None, halo=32, min_area=None,
+                     margin_buffer=None):
+    """Read raster band and extract shapes as polygon vectors, either from the
+    whole band at once or window by window"""
+    return get_bands_vectors(infile, [band], window_size, halo,
+                             min_area=min_area,
+                             margin_buffer=margin_buffer)[0]
+
+
+def get_bands_vectors(infile, bands, window_size=None, halo=32, threads=None,
+                      min_area=None, margin_buffer=None):
+    """Read raster bands in a single pass and extract shapes from each band
+    as polygon vectors
+
+    The raster is opened once and all bands are read together (whole, or per
+    window), with the bands polygonized concurrently in a thread pool
+    """
     with rio.Env():
         with rio.open(infile) as src:
-            image = src.read(band) # first band
-            mask = image == 1
-            results = (
-            {"properties": {"raster_val": v}, "geometry": s}
-            for i, (s, v) 
-            in enumerate(
-                shapes(image,
-                       mask=mask,
-                       transform=src.transform)))
-            
-    geoms = list(results)
-    polys = [shape(g["geometry"]) for g in geoms]
-    return polys
+            transform = src.transform
+            min_pixels = get_min_pixels(min_area, transform)
+            margin = get_margin_geometry(margin_buffer, src.crs)
+            with ThreadPoolExecutor(max_workers=threads or len(bands)) as pool:
+                if window_size is None:
+                    images = src.read(bands)
+                    margin_mask = None
+                    if margin is not None:
+                        margin_mask = get_margin_mask(shapely.to_wkb(margin),
+                                                      transform, src.shape)
+                    return list(pool.map(polygonize, images, repeat(transform),
+                                         repeat(min_pixels), repeat(None),
+                                         repeat(margin_mask)))
+
+                polys = get_windowed_vectors(src, bands, window_size, halo,
+                                             pool, min_pixels, margin)
+
+    # Map pixel coordinates to the raster's coordinate system
+    a, b, c, d, e, f = transform[:6]
+    return [shapely.transform(p, lambda xy: np.column_stack(
+                [a*xy[:,0] + b*xy[:,1] + c, d*xy[:,0] + e*xy[:,1] + f]))
+            for p in polys]
+
+
+def get_min_pixels(min_area, transform):
+    """Get number of pixels covering the threshold area (sq km)"""
+    if min_area is None:
+        return None
+    # Relax by a fraction of a pixel so features at the threshold are kept
+    return min_area * 10**6 / abs(transform.determinant) - 1e-6
+
+
+def get_margin_geometry(margin_buffer, crs):
+    """Load margin buffer as a single geometry collection in the raster's
+    coordinate system"""
+    if margin_buffer is None:
+        return None
+    margin = load(margin_buffer)
+    if crs is not None and margin.crs is not None and margin.crs != crs:
+        margin = margin.to_crs(crs)
+    return shapely.GeometryCollection(list(margin.geometry.dropna()))
+
+
+@lru_cache(maxsize=8)
+def get_margin_mask(margin_wkb, transform, out_shape):
+    """Get rasterized margin buffer, cached per grid so repeat conversions of
+    the same tile only rasterize the buffer once"""
+    mask = rasterize_margin(shapely.from_wkb(margin_wkb), transform, out_shape)
+    mask.flags.writeable = False
+    return mask
+
+
+def rasterize_margin(margin, transform, out_shape):
+    """Rasterize margin geometry onto raster grid, marking all pixels touched
+    by the margin"""
+    margin = shapely.get_parts(margin)
+    if len(margin)==0:
+        return np.zeros(out_shape, dtype=bool)
+    return rasterize(margin, out_shape=out_shape, transform=transform,
+                     all_touched=True, dtype="uint8").astype(bool)
+
+
+def polygonize(image, transform, min_pixels=None, edges=None, margin_mask=None):
+    """Extract shapes of 1-valued pixels in image as polygons, optionally
+    removing features smaller than min_pixels or not touching margin_mask
+    beforehand"""
+    mask = image == 1
+    if min_pixels is not None or margin_mask is not None:
+        mask = sieve_mask(mask, min_pixels, edges, margin_mask)
+
+    # Collect ring coordinates into flat arrays, to construct all polygons in
+    # one call rather than one shapely object per feature
+    coords=[]
+    ring_offsets=[0]
+    geom_offsets=[0]
+    for s, v in shapes(image, mask=mask, transform=transform):
+        for ring in s["coordinates"]:
+            coords.extend(ring)
+            ring_offsets.append(len(coords))
+        geom_offsets.append(len(ring_offsets)-1)
+
+    if len(coords)==0:
+        return np.empty(0, dtype=object)
+    return shapely.from_ragged_array(shapely.GeometryType.POLYGON,
+                                     np.array(coords, dtype=float),
+                                     (np.array(ring_offsets),
+                                      np.array(geom_offsets)))
+
+
+def sieve_mask(mask, min_pixels=None, edges=None, margin_mask=None):
+    """Remove 4-connected features smaller than min_pixels or not touching
+    margin_mask from mask, keeping any feature touching the image edges
+    flagged in edges (top, bottom, left, right), as these may continue beyond
+    the image"""
+    labels, n = ndimage.label(mask)
+    keep = np.ones(n+1, dtype=bool)
+    if min_pixels is not None:
+        keep &= np.bincount(labels.ravel(), minlength=n+1) >= min_pixels
+    if margin_mask is not None:
+        touching = np.zeros(n+1, dtype=bool)
+        touching[labels[margin_mask]] = True
+        keep &= touching
+    if edges is not None:
+        for edge, line in zip(edges, [labels[0], labels[-1],
+                                      labels[:,0], labels[:,-1]]):
+            if edge:
+                keep[line] = True
+    keep[0] = False
+    return keep[labels]
+
+
+def get_windowed_vectors(src, bands, window_size, halo=32, pool=None,
+                         min_pixels=None, margin=None):
+    """Polygonize raster bands window by window, returning polygons of each
+    band in pixel coordinates
+
+    Each window is read with a surrounding halo. Polygons lying wholly inside
+    the padded window are kept by the window containing the top-left corner
+    of their bounds, and all other polygons are clipped to the window and
+    stitched across seams once every window has been read. Working in pixel
+    coordinates keeps seams exactly aligned between windows
+    """
+    mapper = map if pool is None else pool.map
+    complete=[[] for b in bands]
+    pieces=[[] for b in bands]
+    for core in get_windows(src, bands[0], window_size):
+        outer = pad_window(core, halo, src.height, src.width)
+        images = src.read(bands, window=outer)
+
+        # Rasterize the part of the margin buffer within the window
+        margin_mask = None
+        if margin is not None:
+            bounds = windows.bounds(outer, src.transform)
+            margin_mask = rasterize_margin(
+                shapely.clip_by_rect(margin, *bounds),
+                windows.transform(outer, src.transform),
+                (int(outer.height), int(outer.width)))
+
+        results = mapper(split_window_vectors, images, repeat(core),
+                         repeat(outer), repeat(src.shape), repeat(min_pixels),
+                         repeat(margin_mask))
+        for i, (c, p) in enumerate(results):
+            complete[i].extend(c)
+            pieces[i].extend(p)
+
+    # Margin buffer in pixel coordinates, to check stitched polygons against
+    if margin is not None:
+        a, b, c, d, e, f = (~src.transform)[:6]
+        margin = shapely.transform(margin, lambda xy: np.column_stack(
+            [a*xy[:,0] + b*xy[:,1] + c, d*xy[:,0] + e*xy[:,1] + f]))
+
+    return list(mapper(join_window_vectors, complete, pieces,
+                       repeat(min_pixels), repeat(margin)))
+
+
+def split_window_vectors(image, core, outer, raster_shape, min_pixels=None,
+                         margin_mask=None):
+    """Polygonize padded window image and split polygons into those complete
+    and owned by the window, and pieces to stitch across window seams"""
+    col0, row0 = outer.col_off, outer.row_off
+    col1, row1 = col0 + outer.width, row0 + outer.height
+    seams = (row0>0, row1<raster_shape[0], col0>0, col1<raster_shape[1])
+    polys = polygonize(image, Affine.translation(col0, row0), min_pixels,
+                       seams, margin_mask)
+    if len(polys)==0:
+        return polys, polys
+
+    # Find polygons cut by the padded window edge (not the raster edge)
+    minx, miny, maxx, maxy = shapely.bounds(polys).T
+    cut = (((minx==col0) & (col0>0)) |
+           ((miny==row0) & (row0>0)) |
+           ((maxx==col1) & (col1<raster_shape[1])) |
+           ((maxy==row1) & (row1<raster_shape[0])))
+
+    # Find polygons anchored in this window
+    owned = ((minx>=core.col_off) & (minx<core.col_off+core.width) &
+             (miny>=core.row_off) & (miny<core.row_off+core.height))
+
+    # Keep the part of all other polygons within this window for stitching
+    clip = shapely.box(core.col_off, core.row_off,
+                       core.col_off+core.width, core.row_off+core.height)
+    parts = shapely.get_parts(shapely.intersection(polys[cut | ~owned], clip))
+    parts = parts[(shapely.get_type_id(parts)==3) & (shapely.area(parts)>0)]
+    return polys[~cut & owned], parts
+
+
+def join_window_vectors(complete, pieces, min_pixels=None, margin=None):
+    """Join complete polygons and stitched pieces from all windows"""
+    complete = np.array(complete, dtype=object)
+    pieces = np.array(pieces, dtype=object)
+
+    # Drop pieces of polygons that were already kept whole by another window
+    if len(complete)>0 and len(pieces)>0:
+        tree = shapely.STRtree(complete)
+        inside, _ = tree.query(shapely.point_on_surface(pieces),
+                               predicate="within")
+        pieces = np.delete(pieces, inside)
+
+    # Stitch pieces, removing features only partly sieved in windows
+    stitched = stitch_pieces(pieces)
+    if min_pixels is not None:
+        stitched = stitched[shapely.area(stitched) >= min_pixels]
+    if margin is not None and len(stitched)>0:
+        stitched = stitched[shapely.intersects(margin, stitched)]
+    polys = np.concatenate([complete, stitched])
+
+    # Return in raster scan order of the polygon bounds
+    minx, miny, _, _ = shapely.bounds(polys).T
+    return polys[np.lexsort((minx, miny))]
+
+
+def get_windows(src, band, window_size):
+    """Get windows of approximately window_size pixels aligned to the raster
+    band's internal blocks"""
+    block_h, block_w = src.block_shapes[band-1]
+    h = max(block_h, -(-window_size // block_h) * block_h)
+    w = max(block_w, -(-window_size // block_w) * block_w)
+    for row in range(0, src.height, h):
+        for col in range(0, src.width, w):
+            yield Window(col, row, min(w, src.width-col), min(h, src.height-row))
+
+
+def pad_window(window, halo, height, width):
+    """Pad window by halo pixels, clipped to the raster extent"""
+    col0 = max(window.col_off - halo, 0)
+    row0 = max(window.row_off - halo, 0)
+    col1 = min(window.col_off + window.width + halo, width)
+    row1 = min(window.row_off + window.height + halo, height)
+    return Window(col0, row0, col1-col0, row1-row0)
+
+
+def stitch_pieces(pieces):
+    """Merge polygon pieces that share an edge into single polygons"""
+    if len(pieces)==0:
+        return pieces
+
+    # Pieces touching only at a corner are separate (4-connected) features
+    tree = shapely.STRtree(pieces)
+    left, right = tree.query(pieces, predicate="intersects")
+    shared = shapely.length(shapely.intersection(pieces[left],
+                                                 pieces[right])) > 0
+    graph = csr_matrix((np.ones(shared.sum(), dtype=np.int8),
+                        (left[shared], right[shared])),
+                       shape=(len(pieces), len(pieces)))
+    n, labels = connected_components(graph, directed=False)
+
+    order = np.argsort(labels, kind="stable")
+    groups = np.split(pieces[order], np.cumsum(np.bincount(labels))[:-1])
+    return np.array([shapely.union_all(g) for g in groups], dtype=object)
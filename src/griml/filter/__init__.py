@@ -1,3 +1,5 @@
 from griml.filter.filter_area import *
+from griml.filter.split_margin import *
 from griml.filter.filter_margin import *
+from griml.filter.filter_pipeline import *
 from griml.filter.filter_vectors import *
@@ -18,7 +18,11 @@ def filter_area(iml, min_area=0.05):
     iml : geopandas.GeoDataframe
         Filtered vector object
     """
-    iml["area_sqkm"] = iml["geometry"].area/10**6
+    area_sqkm = iml["geometry"].area/10**6
+    keep = (area_sqkm >= min_area).to_numpy()
+
+    # Subset once, and only measure length of kept vectors
+    iml = iml[keep].copy()
+    iml["area_sqkm"] = area_sqkm[keep]
     iml["length_km"] = iml["geometry"].length/1000
-    iml = iml[(iml.area_sqkm >= min_area)]
     return iml
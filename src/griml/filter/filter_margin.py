@@ -2,27 +2,115 @@
 # -*- coding: utf-8 -*-
 
 import geopandas as gpd
-__all__ = ["filter_margin"]
+import numpy as np
+import shapely
+from griml.load import load
+from griml.filter.split_margin import split_margin
 
-def filter_margin(iml, margin_buffer):
-    """Filter vectors by polygon (such as a margin buffer) using a spatial join
+__all__ = ["filter_margin", "MarginFilter"]
+
+def filter_margin(iml, margin_buffer, cell_size=None):
+    """Filter vectors by polygon (such as a margin buffer), keeping vectors
+    that intersect it
     
     Parameters
     ----------
     iml : geopandas.GeoDataframe
         Vector object to filter by area
-    margin_buffer: geopandas.GeoSeries
-        Vector shape which will be used to filter
+    margin_buffer: str, geopandas.GeoDataFrame, GeoSeries or MarginFilter
+        Vector shape which will be used to filter, or a prepared margin
+        filter to reuse across calls
+    cell_size : float, optional
+        Grid cell size to split the margin buffer by before filtering. If
+        None, the margin buffer is not split
     
     Returns
     -------
     iml : geopandas.GeoDataframe
         Filtered vector object
     """
-    iml = gpd.sjoin(iml, margin_buffer, how="left")
-    iml = iml[iml["index_right"]==0]
-    iml = iml.drop(columns="index_right")
+    if not isinstance(margin_buffer, MarginFilter):
+        margin_buffer = MarginFilter(margin_buffer, cell_size)
+    return margin_buffer.filter(iml)
+
+class MarginFilter:
+    """Margin filter with prepared margin buffer geometries and their spatial
+    index, built once and reused for filtering many vector objects
+
+    Parameters
+    ----------
+    margin_buffer : str, geopandas.GeoDataFrame or geopandas.GeoSeries
+        Vector shape (such as a margin buffer) to filter by. Multi-part
+        geometries are indexed by part
+    cell_size : float, optional
+        Grid cell size to split the margin buffer by (see split_margin), so
+        that each vector is only tested against a few small pieces. Pieces
+        of a margin buffer file are cached next to it
+    """
+    def __init__(self, margin_buffer, cell_size=None):
+        if isinstance(margin_buffer, gpd.GeoSeries):
+            margin_buffer = gpd.GeoDataFrame(geometry=margin_buffer)
+        if cell_size is None:
+            margin = load(margin_buffer)
+        else:
+            margin = split_margin(margin_buffer, cell_size)
+        self.crs = margin.crs
+        self.geoms = shapely.get_parts(margin.geometry.dropna().values)
+        shapely.prepare(self.geoms)
+        self.tree = shapely.STRtree(self.geoms)
+        self._projected = {}
+
+    def intersects(self, geoms, crs=None):
+        """Get mask of geometries that intersect the margin buffer
+
+        Parameters
+        ----------
+        geoms : geopandas.GeoSeries or numpy.ndarray
+            Geometries to test
+        crs : pyproj.CRS, optional
+            Projection of geometries, if not given as a GeoSeries. The margin
+            buffer is reprojected to it if needed
+
+        Returns
+        -------
+        mask : numpy.ndarray
+            Boolean mask of geometries intersecting the margin buffer
+        """
+        if crs is None:
+            crs = getattr(geoms, "crs", None)
+        tree = self.get_tree(crs)
+        geoms = np.asarray(getattr(geoms, "values", geoms))
+        # Bounding box candidates, tested against the prepared margin parts
+        a, b = tree.query(geoms)
+        hit = shapely.intersects(tree.geometries[b], geoms[a])
+        mask = np.zeros(len(geoms), dtype=bool)
+        mask[a[hit]] = True
+        return mask
+
+    def filter(self, iml):
+        """Filter vectors to those intersecting the margin buffer
+
+        Parameters
+        ----------
+        iml : geopandas.GeoDataFrame
+            Vector object to filter
+
+        Returns
+        -------
+        iml : geopandas.GeoDataFrame
+            Filtered vector object
+        """
+        iml = iml[self.intersects(iml.geometry)].reset_index(drop=True)
+        return iml
 
-    # Calculate geometry info
-    iml.reset_index(inplace=True, drop=True)
-    return iml
+    def get_tree(self, crs=None):
+        """Get spatial index of margin buffer, reprojected to crs if needed"""
+        if crs is None or self.crs is None or crs == self.crs:
+            return self.tree
+        key = crs.to_wkt()
+        if key not in self._projected:
+            geoms = np.asarray(gpd.GeoSeries(self.geoms, crs=self.crs)
+                               .to_crs(crs).values)
+            shapely.prepare(geoms)
+            self._projected[key] = shapely.STRtree(geoms)
+        return self._projected[key]
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import operator, time
+import numpy as np
+import pandas as pd
+import shapely
+from griml.filter.filter_margin import MarginFilter
+
+__all__ = ["FilterPipeline"]
+
+# Comparison operators for attribute predicates
+OPERATORS = {"==": operator.eq, "!=": operator.ne, "<": operator.lt,
+             "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+class FilterPipeline:
+    """Lazy, composable vector filter
+
+    Predicates are added by chaining (e.g.
+    FilterPipeline().area(0.05).margin(buffer)) and only evaluated when the
+    pipeline is applied. They are then evaluated as boolean masks in order
+    of cost (attribute, bounding box, area and perimeter, then margin),
+    each only on the geometries and column values of the rows kept by the
+    predicates before it, and the vectors are subset once at the end. The number of rows tested and kept by each
+    predicate, and the time taken, are reported
+    """
+    def __init__(self):
+        self.predicates = []
+        self.report = []
+
+    def add(self, name, func, cost):
+        """Add predicate, as a function of the candidate rows returning a
+        boolean mask
+
+        Parameters
+        ----------
+        name : str
+            Predicate name, for reporting
+        func : function
+            Function of candidate rows (a Rows view, with the geometry and
+            column values of the candidate rows only) returning a boolean
+            mask of rows to keep
+        cost : float
+            Relative cost of evaluating the predicate per row
+
+        Returns
+        -------
+        pipeline : FilterPipeline
+            Pipeline with predicate added
+        """
+        self.predicates.append((name, func, cost))
+        return self
+
+    def attribute(self, column, op, value=None):
+        """Keep rows with attribute values meeting a condition
+
+        Parameters
+        ----------
+        column : str
+            Attribute column name
+        op : str or function
+            Comparison operator ("==", "!=", "<", "<=", ">", ">=" or "in"),
+            or function of the column values returning a boolean mask
+        value : optional
+            Value (or list of values, for "in") to compare against
+        """
+        if callable(op):
+            func = lambda rows: np.asarray(op(rows[column]), dtype=bool)
+        elif op == "in":
+            func = lambda rows: pd.Index(rows[column]).isin(value)
+        else:
+            func = lambda rows: np.asarray(OPERATORS[op](rows[column], value),
+                                           dtype=bool)
+        return self.add(column + " " + getattr(op, "__name__", str(op)),
+                        func, 1)
+
+    def bbox(self, bounds):
+        """Keep rows with geometry bounds intersecting a bounding box
+
+        Parameters
+        ----------
+        bounds : tuple
+            Bounding box (minx, miny, maxx, maxy)
+        """
+        def func(rows):
+            b = shapely.bounds(rows.geometry)
+            return (b[:,0] <= bounds[2]) & (b[:,2] >= bounds[0]) & \
+                   (b[:,1] <= bounds[3]) & (b[:,3] >= bounds[1])
+        return self.add("bbox", func, 2)
+
+    def area(self, min_area=0.05, max_area=None):
+        """Keep rows with geometry area (sq km) within limits
+
+        Parameters
+        ----------
+        min_area : float, optional
+            Minimum area (sq km)
+        max_area : float, optional
+            Maximum area (sq km)
+        """
+        def func(rows):
+            return within(shapely.area(rows.geometry)/10**6,
+                          min_area, max_area)
+        return self.add("area", func, 3)
+
+    def perimeter(self, min_length=None, max_length=None):
+        """Keep rows with geometry perimeter (km) within limits
+
+        Parameters
+        ----------
+        min_length : float, optional
+            Minimum perimeter (km)
+        max_length : float, optional
+            Maximum perimeter (km)
+        """
+        def func(rows):
+            return within(shapely.length(rows.geometry)/1000,
+                          min_length, max_length)
+        return self.add("perimeter", func, 3)
+
+    def margin(self, margin_buffer):
+        """Keep rows with geometries intersecting a margin buffer
+
+        Parameters
+        ----------
+        margin_buffer : str, geopandas.GeoDataFrame or MarginFilter
+            Margin buffer, or prepared margin filter
+        """
+        if not isinstance(margin_buffer, MarginFilter):
+            margin_buffer = MarginFilter(margin_buffer)
+        return self.add("margin", lambda rows: margin_buffer.intersects(
+            rows.geometry), 10)
+
+    def mask(self, gdf, verbose=True):
+        """Get boolean mask of rows kept by all predicates
+
+        Parameters
+        ----------
+        gdf : geopandas.GeoDataFrame
+            Vectors to filter
+        verbose : bool, optional
+            Flag to print the number of rows kept by each predicate
+
+        Returns
+        -------
+        mask : numpy.ndarray
+            Boolean mask of rows to keep
+        """
+        self.report = []
+        keep = np.arange(gdf.shape[0])
+        for name, func, cost in sorted(self.predicates, key=lambda p: p[2]):
+            start = time.perf_counter()
+            tested = len(keep)
+            if tested > 0:
+                keep = keep[np.asarray(func(Rows(gdf, keep)), dtype=bool)]
+            self.report.append({
+                "predicate": name, "tested": tested, "kept": len(keep),
+                "selectivity": len(keep)/tested if tested > 0 else np.nan,
+                "seconds": time.perf_counter() - start})
+            if verbose:
+                print(f"{len(keep)} of {tested} features kept by {name} "
+                      f"filter ({self.report[-1]['seconds']:.2f} s)")
+
+        mask = np.zeros(gdf.shape[0], dtype=bool)
+        mask[keep] = True
+        return mask
+
+    def apply(self, gdf, verbose=True):
+        """Filter vectors by all predicates
+
+        Parameters
+        ----------
+        gdf : geopandas.GeoDataFrame
+            Vectors to filter
+        verbose : bool, optional
+            Flag to print the number of rows kept by each predicate
+
+        Returns
+        -------
+        gdf : geopandas.GeoDataFrame
+            Filtered vectors, with the filter report in its attributes
+        """
+        gdf = gdf[self.mask(gdf, verbose)].reset_index(drop=True)
+        gdf.attrs["filter_report"] = self.report
+        return gdf
+
+class Rows:
+    """Candidate rows of vectors, as a view returning the geometries and
+    column values of the candidate rows only when accessed
+
+    Parameters
+    ----------
+    gdf : geopandas.GeoDataFrame
+        Vectors
+    positions : numpy.ndarray
+        Row positions of candidate rows
+    """
+    def __init__(self, gdf, positions):
+        self.gdf = gdf
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, column):
+        """Get values of column for candidate rows"""
+        return self.take(self.gdf[column].to_numpy())
+
+    @property
+    def geometry(self):
+        """Get geometries of candidate rows, with their projection"""
+        return self.take(self.gdf.geometry.values)
+
+    def take(self, values):
+        """Get values at candidate row positions, without copying if all
+        rows are candidates"""
+        if len(self.positions) == len(values):
+            return values
+        return values[self.positions]
+
+def within(values, lower=None, upper=None):
+    """Get mask of values within optional lower and upper limits"""
+    mask = np.ones(len(values), dtype=bool)
+    if lower is not None:
+        mask &= values >= lower
+    if upper is not None:
+        mask &= values <= upper
+    return mask
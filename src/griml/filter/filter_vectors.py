@@ -1,15 +1,18 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-from griml.filter import filter_margin, filter_area
-from griml.load import load
+from griml.filter import MarginFilter, FilterPipeline, split_margin
+from griml.load import load, write
 import geopandas as gpd
+import shapely
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-import os
 
 __all__ = ["filter_vectors"]
 
-def filter_vectors(inlist, margin_file, min_area=0.05, outdir=None, overwrite=False):
+def filter_vectors(inlist, margin_file, min_area=0.05, outdir=None,
+                   overwrite=False, ext=".gpkg", workers=None,
+                   cell_size=None):
     """Filter vectors by area and margin proximity
 
     Parameters
@@ -24,65 +27,123 @@ def filter_vectors(inlist, margin_file, min_area=0.05, outdir=None, overwrite=Fa
         Output directory to write files to
     overwrite : bool, optional
         Flag to overwrite existing file
+    ext : str, optional
+        Output file extension, setting the output format (e.g. ".gpkg" or
+        ".parquet")
+    workers : int, optional
+        Number of worker processes to filter files with. If greater than 1,
+        each worker receives the margin buffer once on start-up and writes
+        its own outputs, and a summary of each file is returned instead of
+        the filtered vectors
+    cell_size : float, optional
+        Grid cell size to split the margin buffer by, so that vectors are only
+        tested against small pieces of it. Pieces of a margin buffer file are
+        cached next to it. If None, the margin buffer is not split
 
     Returns
     -------
     filtered : list
-        List of filtered GeoDataFrame objects
+        List of filtered GeoDataFrame objects, or if workers are used, a
+        summary of feature counts kept by each filter (or None if failed)
+        for each file in input order
     """
     
-    # Load margin
-    margin_buff = load(margin_file)
-    
-    # Iterate through input list
-    count=1
-    filtered=[]
-    for infile in inlist:
-    
-        # Load and define name
+    # Load margin, split into pieces if requested
+    if cell_size is None:
+        margin = load(margin_file, cache=True)
+    else:
+        margin = split_margin(margin_file, cell_size)
+
+    # Define output names
+    names = []
+    for count, infile in enumerate(inlist, start=1):
         if type(infile)==str:
-            print("\n"+str(count)+"/"+str(len(inlist)) +
-                  ": Filtering vectors in "+str(Path(infile).name))   
-            name = str(Path(infile).stem)+"_filtered.gpkg"
-            
+            names.append(str(Path(infile).stem)+"_filtered"+ext)
         else:
-            print("\n"+str(count)+"/"+str(len(inlist))) 
-            name = "lakes_" + str(count) + "_filtered.gpkg"
-        
-        vectors = load(infile)
+            names.append("lakes_" + str(count) + "_filtered"+ext)
+    outfiles = [None if outdir is None else str(Path(outdir).joinpath(n))
+                for n in names]
 
-        # Perform filtering steps
-        vectors = filter_area(vectors, min_area)
-        print(f"{vectors.shape[0]} features over 0.05 sq km")
-        
-        vectors = filter_margin(vectors, margin_buff)
-        print(f"{vectors.shape[0]} features within 500 m of margin")    
+    # Iterate through input list, preparing the margin index once
+    if workers is None or workers < 2:
+        margin_buff = MarginFilter(margin)
+        filtered=[]
+        for count, (infile, outfile) in enumerate(zip(inlist, outfiles),
+                                                  start=1):
+            if type(infile)==str:
+                print("\n"+str(count)+"/"+str(len(inlist)) +
+                      ": Filtering vectors in "+str(Path(infile).name))
+            else:
+                print("\n"+str(count)+"/"+str(len(inlist)))
 
-        # Retain and save if vectors are present after filtering
-        if vectors.shape[0]>0:
+            vectors, summary = filter_file(infile, margin_buff, min_area,
+                                           outfile, overwrite)
+            if vectors.shape[0]>0:
+                filtered.append(vectors)
+        return filtered
 
-            if outdir is not None:
-                outfile = Path(outdir).joinpath(name)
+    # Or distribute files across worker processes, sending the margin
+    # buffer to each worker once as WKB
+    summaries=[]
+    wkb = shapely.to_wkb(margin.geometry.dropna().values)
+    crs = None if margin.crs is None else margin.crs.to_wkt()
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(wkb, crs)) as pool:
+        futures = [pool.submit(filter_file, infile, None, min_area, outfile,
+                               overwrite, True)
+                   for infile, outfile in zip(inlist, outfiles)]
+        for count, (n, f) in enumerate(zip(names, futures), start=1):
+            try:
+                summary = f.result()
+                print("\n"+str(count)+"/"+str(len(inlist)) + ": Filtered " +
+                      str(summary["input"]) + " to " + str(summary["margin"]) +
+                      " features for " + n)
+            except Exception as e:
+                print("\n"+str(count)+"/"+str(len(inlist)) +
+                      ": Failed to filter " + n + ": " + str(e))
+                summary = None
+            summaries.append(summary)
 
-                if os.path.isfile(outfile):
-                    if overwrite:
-                        print("Overwriting existing file...")
-                        vectors.to_file(outfile)
-                        print("Overwritten file saved to " + str(outfile))
-                    else:
-                        print("File exists and will not be overwritten. Moving to next file")
-                else:
-                    print("Writing new file...")
-                    vectors.to_file(outfile)
-                    print("New file saved to " + str(outfile))
+    return summaries
 
-            filtered.append(vectors)
+# Margin filter of worker process, set on start-up
+_WORKER = {}
 
-        else:
-        	print("No vectors present after filter. Moving to next file.")
-        count=count+1
+def init_worker(wkb, crs):
+    """Build margin filter of worker process from margin buffer WKB"""
+    _WORKER["margin"] = MarginFilter(gpd.GeoDataFrame(
+        geometry=shapely.from_wkb(wkb), crs=crs))
+
+def filter_file(infile, margin_buff=None, min_area=0.05, outfile=None,
+                overwrite=False, summary_only=False):
+    """Filter a single vector file or object by area and margin, returning
+    the filtered vectors and a summary of feature counts kept by each
+    filter, or only the summary"""
+    if margin_buff is None:
+        margin_buff = _WORKER["margin"]
+    vectors = load(infile)
+    summary = {"input": vectors.shape[0]}
+
+    # Perform filtering steps, as masks subset once at the end
+    pipeline = FilterPipeline().area(min_area).margin(margin_buff)
+    vectors = pipeline.apply(vectors)
+    for step in pipeline.report:
+        summary[step["predicate"]] = step["kept"]
+    vectors["area_sqkm"] = vectors["geometry"].area/10**6
+    vectors["length_km"] = vectors["geometry"].length/1000
+
+    # Save if vectors are present after filtering
+    summary["outfile"] = None
+    if vectors.shape[0]>0:
+        if outfile is not None:
+            write(vectors, outfile, overwrite)
+            summary["outfile"] = outfile
+    else:
+        print("No vectors present after filter. Moving to next file.")
 
-    return filtered
+    if summary_only:
+        return summary
+    return vectors, summary
         
 
 
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import glob, os
+import geopandas as gpd
+import numpy as np
+import shapely
+from griml.load import load, write
+from griml.load.cache import cached_build, get_file_hash
+
+__all__ = ["split_margin"]
+
+def split_margin(margin_buffer, cell_size=50000.0, save=True):
+    """Split margin buffer into pieces along a grid, so that intersects tests
+    only walk the vertices of a few small pieces. Pieces of a margin buffer
+    file are saved to (and read from) a sidecar GeoParquet file next to it,
+    named by the file contents hash
+
+    Parameters
+    ----------
+    margin_buffer : str or geopandas.GeoDataFrame
+        Margin buffer filepath or vector object
+    cell_size : float, optional
+        Grid cell size, in units of the margin buffer projection
+    save : bool, optional
+        Flag to save pieces next to the margin buffer file
+
+    Returns
+    -------
+    pieces : geopandas.GeoDataFrame
+        Polygon pieces of margin buffer, each within one grid cell
+    """
+    if not isinstance(margin_buffer, str):
+        return build_margin_pieces(load(margin_buffer), cell_size)
+    pieces = cached_build(margin_buffer, ("split_margin", float(cell_size)),
+                          lambda: read_margin_pieces(margin_buffer, cell_size,
+                                                     save))
+    return pieces.copy()
+
+def read_margin_pieces(margin_buffer, cell_size=50000.0, save=True):
+    """Read margin buffer pieces from sidecar file if they were split from
+    the same margin file, or otherwise split margin and save sidecar"""
+    prefix = margin_buffer + "." + repr(float(cell_size)) + "m."
+    sidecar = prefix + get_file_hash(margin_buffer)[:16] + ".split.parquet"
+    if os.path.isfile(sidecar):
+        return load(sidecar)
+
+    # Replace any outdated sidecar
+    pieces = build_margin_pieces(load(margin_buffer, cache=True), cell_size)
+    if save:
+        try:
+            for f in glob.glob(glob.escape(prefix) + "*.split.parquet"):
+                os.remove(f)
+            write(pieces, sidecar)
+        except OSError:
+            print("Could not save margin pieces to " + sidecar)
+    return pieces
+
+def build_margin_pieces(gdf, cell_size=50000.0):
+    """Cut margin buffer polygons into grid cell pieces"""
+    parts = shapely.get_parts(gdf.geometry.dropna().values)
+    pieces = []
+    if len(parts) > 0:
+        x0, y0 = np.floor(shapely.total_bounds(parts)[:2] / cell_size) * \
+            cell_size
+        b = shapely.bounds(parts)
+        i0 = np.floor((b[:,0] - x0) / cell_size).astype(int)
+        j0 = np.floor((b[:,1] - y0) / cell_size).astype(int)
+        i1 = np.maximum(np.ceil((b[:,2] - x0) / cell_size).astype(int), i0+1)
+        j1 = np.maximum(np.ceil((b[:,3] - y0) / cell_size).astype(int), j0+1)
+        for p, a, c, d, e in zip(parts, i0, j0, i1, j1):
+            pieces.extend(cut_by_grid(p, x0, y0, cell_size, a, c, d, e))
+
+    # Keep polygonal pieces only
+    pieces = shapely.get_parts(np.array(pieces, dtype=object))
+    pieces = pieces[shapely.get_type_id(pieces) == 3]
+    return gpd.GeoDataFrame(geometry=pieces, crs=gdf.crs)
+
+def cut_by_grid(geom, x0, y0, cell_size, i0, j0, i1, j1):
+    """Cut geometry into grid cells (i0 to i1 by j0 to j1), by recursively
+    halving the cell range along grid lines"""
+    if shapely.is_empty(geom):
+        return []
+    if i1 - i0 <= 1 and j1 - j0 <= 1:
+        return [geom]
+    xmin, ymin, xmax, ymax = shapely.bounds(geom)
+    if i1 - i0 >= j1 - j0:
+        m = (i0 + i1) // 2
+        x = x0 + m * cell_size
+        halves = [(xmin < x, (xmin, ymin, min(x, xmax), ymax),
+                   (i0, j0, m, j1)),
+                  (xmax > x, (max(x, xmin), ymin, xmax, ymax),
+                   (m, j0, i1, j1))]
+    else:
+        m = (j0 + j1) // 2
+        y = y0 + m * cell_size
+        halves = [(ymin < y, (xmin, ymin, xmax, min(y, ymax)),
+                   (i0, j0, i1, m)),
+                  (ymax > y, (xmin, max(y, ymin), xmax, ymax),
+                   (i0, m, i1, j1))]
+
+    # Only cut if the grid line crosses the geometry
+    if not all(h[0] for h in halves):
+        r = [h[2] for h in halves if h[0]][0]
+        return cut_by_grid(geom, x0, y0, cell_size, *r)
+    out = []
+    for inside, bounds, r in halves:
+        piece = shapely.intersection(geom, shapely.box(*bounds))
+        out.extend(cut_by_grid(piece, x0, y0, cell_size, *r))
+    return out
@@ -1 +1,3 @@
+from griml.load.cache import *
 from griml.load.load import *
+from griml.load.write import *
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import hashlib, os, threading
+from collections import OrderedDict
+import numpy as np
+import shapely
+
+__all__ = [
+    "cache_info",
+    "clear_cache",
+    "set_cache_budget",
+]
+
+# Process-wide cache of loaded vector files, in least recently used order
+_CACHE = OrderedDict()
+_LOCK = threading.Lock()
+_STATE = {"budget": 1024**3, "bytes": 0, "hits": 0, "misses": 0}
+
+def set_cache_budget(max_bytes):
+    """Set the memory budget of the vector file cache, evicting least recently
+    used files to fit
+
+    Parameters
+    ----------
+    max_bytes : int
+        Maximum estimated size (in bytes) of cached vectors. A budget of 0
+        disables caching
+    """
+    with _LOCK:
+        _STATE["budget"] = int(max_bytes)
+        _evict()
+
+def clear_cache(infile=None):
+    """Invalidate cached vectors
+
+    Parameters
+    ----------
+    infile : str, optional
+        File path to invalidate cached vectors of. If None, the whole cache is
+        cleared
+    """
+    with _LOCK:
+        if infile is None:
+            keys = list(_CACHE)
+        else:
+            path = os.path.abspath(infile)
+            keys = [k for k in _CACHE if k[0] == path]
+        for k in keys:
+            _STATE["bytes"] -= _CACHE.pop(k)[1]
+
+def cache_info():
+    """Get vector file cache statistics
+
+    Returns
+    -------
+    info : dict
+        Number of hits, misses and cached entries, and cached and budgeted
+        size (in bytes)
+    """
+    with _LOCK:
+        return {"hits": _STATE["hits"], "misses": _STATE["misses"],
+                "entries": len(_CACHE), "bytes": _STATE["bytes"],
+                "budget": _STATE["budget"]}
+
+def cached_read(infile, reader, columns=None, bbox=None):
+    """Read vector file through the cache, keyed by file path, modification
+    time, size and read options, so that changed files are re-read"""
+    key = get_key(infile, None if columns is None else tuple(columns),
+                  None if bbox is None else tuple(bbox))
+    found, gdf = lookup(key)
+    if found:
+        return gdf.copy()
+    gdf = reader(infile, columns, bbox)
+    store(key, gdf, get_size(gdf))
+    return gdf.copy()
+
+def cached_build(infile, name, builder):
+    """Get object built from file (such as an index or a sidecar file read)
+    through the cache, keyed by file path, modification time, size and build
+    name, so that it is rebuilt when the file changes. Built objects are
+    shared between calls and should not be modified"""
+    key = get_key(infile, name, None)
+    found, obj = lookup(key)
+    if found:
+        return obj
+    obj = builder()
+    store(key, obj, get_object_size(obj))
+    return obj
+
+def get_key(infile, options, bbox):
+    """Get cache key from file path, status and options"""
+    stat = os.stat(infile)
+    return (os.path.abspath(infile), stat.st_mtime_ns, stat.st_size, options,
+            bbox)
+
+def lookup(key):
+    """Get flag of whether key is cached, and cached object"""
+    with _LOCK:
+        if key in _CACHE:
+            _CACHE.move_to_end(key)
+            _STATE["hits"] += 1
+            return True, _CACHE[key][0]
+        _STATE["misses"] += 1
+    return False, None
+
+def store(key, obj, size):
+    """Add object to cache if it fits the budget, dropping entries from older
+    versions of the same file"""
+    with _LOCK:
+        if size <= _STATE["budget"] and key not in _CACHE:
+            for k in [k for k in _CACHE if k[0] == key[0] and
+                      k[1:3] != key[1:3]]:
+                _STATE["bytes"] -= _CACHE.pop(k)[1]
+            _CACHE[key] = (obj, size)
+            _STATE["bytes"] += size
+            _evict()
+
+def get_size(gdf):
+    """Estimate memory size (in bytes) of GeoDataFrame, including geometries"""
+    size = gdf.drop(columns=gdf.geometry.name).memory_usage(deep=True).sum()
+    geoms = gdf.geometry.values
+    return int(size + 16*np.sum(shapely.get_num_coordinates(geoms)) +
+               100*len(geoms))
+
+def get_object_size(obj):
+    """Estimate memory size (in bytes) of built object, from its vectors,
+    arrays and geometries"""
+    if hasattr(obj, "geometry") and hasattr(obj, "memory_usage"):
+        return get_size(obj)
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object and len(obj) > 0 and \
+           isinstance(obj.flat[0], shapely.Geometry):
+            return int(obj.nbytes + 16*np.sum(shapely.get_num_coordinates(obj))
+                       + 100*obj.size)
+        if obj.dtype == object:
+            return int(obj.nbytes + 50*obj.size)
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sum(get_object_size(v) for v in obj.values())
+    if isinstance(obj, (tuple, list)):
+        return sum(get_object_size(v) for v in obj)
+    return 100
+
+def get_file_hash(infile):
+    """Get SHA-256 hash of file contents"""
+    h = hashlib.sha256()
+    with open(infile, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _evict():
+    """Evict least recently used entries until the cache fits its budget"""
+    while _CACHE and _STATE["bytes"] > _STATE["budget"]:
+        _STATE["bytes"] -= _CACHE.popitem(last=False)[1][1]
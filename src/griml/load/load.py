@@ -3,7 +3,10 @@
 
 import geopandas as gpd
 import pandas as pd
-import os, errno
+import pyarrow.parquet as pq
+import shapely
+from griml.load.cache import cached_read
+import os, errno, json
 from pathlib import Path
 
 __all__ = [
@@ -11,13 +14,23 @@ __all__ = [
     "load_vector_from_file",
 ]
 
-def load(i): 
+def load(i, columns=None, bbox=None, cache=False):
     """Load vectors into appropriate format for processing
 
     Parameters
     ----------
     i : str, geopandas.geodataframe.GeoDataFrame, pandas.core.series.Series
         Input vectors (either from file or vector object)
+    columns : list, optional
+        Names of columns to read from file, besides geometry. If None, all
+        columns are read
+    bbox : tuple, optional
+        Bounding box (minx, miny, maxx, maxy) to read features from file
+        within. If None, all features are read
+    cache : bool, optional
+        Flag to read file through the process-wide vector cache, so that
+        repeat loads of an unchanged file (such as a reference dataset) are
+        only read from disk once
 
     Returns
     -------
@@ -26,7 +39,10 @@ def load(i):
     """
     if is_string(i):
         if is_filepath(i):
-            out = load_vector_from_file(i)
+            if cache:
+                out = cached_read(i, load_vector_from_file, columns, bbox)
+            else:
+                out = load_vector_from_file(i, columns, bbox)
             return out
         
         else:
@@ -39,11 +55,42 @@ def load(i):
     else:  
         TypeError("Expected str, geopandas.geodataframe.GeoDataFrame or pandas.core.series.Series object, but instead got "+str(type(i)))
     
-def load_vector_from_file(infile):
-    """Load vector object from file"""
-    gdf = gpd.read_file(infile)
+def load_vector_from_file(infile, columns=None, bbox=None):
+    """Load vector object from file, reading (Geo)Parquet files by extension
+    and otherwise any format supported by geopandas"""
+    if is_parquet(infile):
+        geo = get_parquet_geo_metadata(infile)
+        geom = geo.get("primary_column", "geometry")
+        if columns is not None:
+            columns = list(columns) + [geom] if geom not in columns else columns
+
+        # Filter by bounding box covering column if present, or otherwise by
+        # geometry bounds once read
+        covering = geo.get("columns", {}).get(geom, {}).get("covering")
+        if bbox is None or covering is not None:
+            gdf = gpd.read_parquet(infile, columns=columns, bbox=bbox)
+        else:
+            gdf = gpd.read_parquet(infile, columns=columns)
+            b = shapely.bounds(gdf.geometry.values)
+            keep = (b[:,0] <= bbox[2]) & (b[:,2] >= bbox[0]) & \
+                   (b[:,1] <= bbox[3]) & (b[:,3] >= bbox[1])
+            gdf = gdf[keep]
+    else:
+        gdf = gpd.read_file(infile, columns=columns, bbox=bbox)
     return gdf
 
+def is_parquet(n):
+    """Check if file is (Geo)Parquet from its extension"""
+    return Path(n).suffix.lower() in [".parquet", ".geoparquet"]
+
+def get_parquet_geo_metadata(infile):
+    """Get GeoParquet metadata from Parquet file schema, or an empty
+    dictionary if there is none"""
+    metadata = pq.read_schema(infile).metadata or {}
+    if b"geo" in metadata:
+        return json.loads(metadata[b"geo"])
+    return {}
+
 def is_string(n):
     """Check if input for loading is string"""
     if type(n)==str:
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import itertools, json, os, uuid
+from pathlib import Path
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+from pyogrio.raw import write_arrow
+from griml.load.load import is_parquet
+
+__all__ = ["write"]
+
+def write(vectors, outfile, overwrite=False, geometry_type=None):
+    """Write vectors to file, streaming chunks of features to a single layer
+
+    GeoPackage (.gpkg) and GeoParquet (.parquet or .geoparquet) outputs are
+    written chunk by chunk to a temporary file in one transaction, with any
+    spatial index built after the last insert, and then moved to the output
+    file path so that partially written files are never left behind.
+    GeoParquet files include a bounding box column for bbox-filtered reads.
+    Other formats are written once all chunks have been compiled
+
+    Parameters
+    ----------
+    vectors : geopandas.GeoDataFrame or iterable
+        Vectors to write, either as a single GeoDataFrame or an iterable (such
+        as a generator) of GeoDataFrame chunks with the same columns
+    outfile : str
+        Output file path
+    overwrite : bool, optional
+        Flag to overwrite existing file
+    geometry_type : str, optional
+        Geometry type of the GeoPackage output layer. If None, it is inferred
+        from a single chunk, or otherwise "Unknown"
+
+    Returns
+    -------
+    count : int or None
+        Number of features written, or None if the file exists and was not
+        overwritten
+    """
+    outfile = str(outfile)
+    if os.path.isfile(outfile):
+        if overwrite:
+            print("Overwriting existing file")
+        else:
+            print("File exists and will not be overwritten. Moving to next file")
+            return None
+    else:
+        print("Writing new file")
+        overwrite = False
+
+    if isinstance(vectors, gpd.GeoDataFrame):
+        vectors = [vectors]
+    chunks = iter(vectors)
+
+    suffix = Path(outfile).suffix.lower()
+    if suffix == ".gpkg" or is_parquet(outfile):
+        tmpfile = str(Path(outfile).with_name("." + Path(outfile).stem + "-" +
+                                              uuid.uuid4().hex + suffix))
+        try:
+            if is_parquet(outfile):
+                count = write_parquet(chunks, tmpfile)
+            else:
+                count = write_gpkg(chunks, tmpfile, Path(outfile).stem,
+                                   geometry_type)
+            os.replace(tmpfile, outfile)
+        finally:
+            if os.path.isfile(tmpfile):
+                os.remove(tmpfile)
+
+    else:
+        gdf = pd.concat(list(chunks))
+        gdf.to_file(outfile)
+        count = gdf.shape[0]
+
+    if overwrite:
+        print("Overwritten file saved to " + str(outfile))
+    else:
+        print("New file saved to " + str(outfile))
+    return count
+
+def write_gpkg(chunks, outfile, layer, geometry_type=None):
+    """Stream GeoDataFrame chunks to GeoPackage layer in one transaction"""
+    first = next(chunks, None)
+    if first is None:
+        raise ValueError("Expected at least one chunk of vectors to write")
+
+    # Take output schema from first chunk with features, if any
+    pending = [first]
+    while first.shape[0] == 0:
+        c = next(chunks, None)
+        if c is None:
+            break
+        pending.append(c)
+        first = c
+    schema = to_arrow(first).schema
+
+    # Geometry types of later chunks are not known before they are written
+    if geometry_type is None:
+        c = next(chunks, None)
+        if c is None:
+            geometry_type = get_geometry_type(first)
+        else:
+            pending.append(c)
+            geometry_type = "Unknown"
+    counter = [0]
+
+    def batches():
+        """Yield record batches from all chunks in output schema"""
+        for c in itertools.chain(pending, chunks):
+            if c.shape[0] == 0:
+                continue
+            t = to_arrow(c).cast(schema)
+            counter[0] += t.num_rows
+            yield from t.to_batches()
+
+    # Spatial index creation is deferred by GDAL until the layer is closed
+    write_arrow(pa.RecordBatchReader.from_batches(schema, batches()),
+                outfile, layer=layer, driver="GPKG",
+                geometry_name=first.geometry.name,
+                geometry_type=geometry_type,
+                crs=first.crs.to_wkt() if first.crs is not None else None,
+                layer_options={"GEOMETRY_NAME": first.geometry.name})
+    return counter[0]
+
+def write_parquet(chunks, outfile):
+    """Stream GeoDataFrame chunks to GeoParquet file as row groups"""
+    writer = None
+    empty = None
+    count = 0
+    bounds = None
+    types = set()
+    try:
+        for c in chunks:
+            # Take output schema from first chunk with features, if any
+            if c.shape[0] == 0:
+                if writer is None:
+                    empty = c
+                continue
+
+            table = bbox_table(c)
+            if writer is None:
+                first = c
+                schema = table.schema
+                writer = pq.ParquetWriter(outfile, schema)
+            writer.write_table(table.cast(schema), row_group_size=65536)
+
+            # Track metadata over all chunks
+            count += table.num_rows
+            types.update(c.geometry.geom_type.dropna())
+            if c.shape[0] > 0 and not c.geometry.is_empty.all():
+                b = c.total_bounds
+                bounds = b if bounds is None else [min(bounds[0], b[0]),
+                                                   min(bounds[1], b[1]),
+                                                   max(bounds[2], b[2]),
+                                                   max(bounds[3], b[3])]
+    except Exception:
+        if writer is not None:
+            writer.close()
+        raise
+
+    if writer is None:
+        if empty is None:
+            raise ValueError("Expected at least one chunk of vectors to write")
+        first = empty
+        writer = pq.ParquetWriter(outfile, bbox_table(empty).schema)
+
+    # File-level GeoParquet metadata is written with the footer
+    column = {"encoding": "WKB", "geometry_types": sorted(types),
+              "covering": {"bbox": {k: ["bbox", k] for k in
+                                    ["xmin", "ymin", "xmax", "ymax"]}}}
+    if first.crs is not None:
+        column["crs"] = first.crs.to_json_dict()
+    if bounds is not None:
+        column["bbox"] = [float(b) for b in bounds]
+    writer.add_key_value_metadata({"geo": json.dumps(
+        {"version": "1.1.0",
+         "primary_column": first.geometry.name,
+         "columns": {first.geometry.name: column}})})
+    writer.close()
+    return count
+
+def bbox_table(gdf):
+    """Convert GeoDataFrame to Arrow table with a bounding box covering
+    column, for bbox-filtered reads"""
+    b = shapely.bounds(gdf.geometry.values)
+    return to_arrow(gdf).append_column("bbox", pa.StructArray.from_arrays(
+        [pa.array(b[:,i], type=pa.float64()) for i in range(4)],
+        names=["xmin", "ymin", "xmax", "ymax"]))
+
+def to_arrow(gdf):
+    """Convert GeoDataFrame to Arrow table with WKB geometries, keeping any
+    named or non-default index as a column. Categorical columns are given
+    32-bit dictionary indices, so that their type does not depend on the
+    number of categories in a chunk"""
+    if gdf.index.name is not None or not isinstance(gdf.index, pd.RangeIndex):
+        gdf = gdf.reset_index()
+    table = pa.table(gdf.to_arrow(index=False, geometry_encoding="WKB"))
+    fields = [pa.field(f.name, pa.dictionary(pa.int32(), f.type.value_type),
+                       f.nullable, f.metadata)
+              if pa.types.is_dictionary(f.type) else f
+              for f in table.schema]
+    return table.cast(pa.schema(fields, table.schema.metadata))
+
+def get_geometry_type(gdf):
+    """Get layer geometry type from GeoDataFrame geometries"""
+    types = set(gdf.geometry.geom_type.dropna())
+    if len(types) == 1:
+        return types.pop()
+    return "Unknown"
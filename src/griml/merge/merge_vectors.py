@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import os
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
 from glob import glob
-from griml.load import load
+from pathlib import Path
+from pandas.api.types import union_categoricals
+from griml.load import load, write
+from griml.load.load import is_parquet
 
 __all__ = ["merge_vectors"]
 
-def merge_vectors(inlist, proj="EPSG:3413", outfile=None, overwrite=False):
+# Metadata columns carried over from each input
+COLUMNS = ["method", "source", "startdate", "enddate"]
+
+def merge_vectors(inlist, proj="EPSG:3413", outfile=None, overwrite=False,
+                  batch_size=None, return_merged=False):
     """Compile features from multiple processings into one geodataframe
 
     Parameters
@@ -22,55 +30,82 @@ def merge_vectors(inlist, proj="EPSG:3413", outfile=None, overwrite=False):
         Output file path to write files toall_gdf.to_file(outfile)
     overwrite : bool, optional
         Flag to overwrite existing file
+    batch_size : int, optional
+        Number of inputs to read at a time, streaming each merged batch to
+        outfile so that all inputs are never loaded at once. The output must
+        be a GeoPackage (.gpkg) or GeoParquet (.parquet or .geoparquet) file.
+        Row IDs are numbered across all inputs, and metadata columns are
+        written as strings rather than categories. If None, all inputs are loaded and
+        merged together, with row IDs numbered within each input
+    return_merged : bool, optional
+        Flag to read back and return the merged inventory when streaming
+        with batch_size. Otherwise the output file path is returned
+
     Returns
     -------
-    all_gdf : geopandas.dataframe.GeoDataFrame
-        Compiled goedataframe
+    all_gdf : geopandas.dataframe.GeoDataFrame or str
+        Compiled goedataframe, or output file path if streamed with
+        batch_size and not returned
     """
-    feature, method, collection, start_date, end_date = load_all(inlist)
-    dfs=[]
-    for a,b,c,d,e in zip(feature, method, collection, start_date, end_date):
-        if a is not None:
-            
-            #Construct geodataframe with basic metadata
-            gdf = gpd.GeoDataFrame(geometry=a, crs=proj)
-            # gdf = dissolve_vectors(gdf)
-            dfs.append(pd.DataFrame({"geometry": list(gdf.geometry), 
-                                      "method": b, 
-                                      "source": c, 
-                                      "startdate" : d, 
-                                      "enddate" : e}))   
-           
-    # Construct merged geodataframe
-    all_gdf = pd.concat(dfs)
-    all_gdf = gpd.GeoDataFrame(all_gdf, crs=proj, geometry=list(all_gdf.geometry))
-    
-    all_gdf["row_id"] = all_gdf.index + 1
-    all_gdf.reset_index(drop=True, inplace=True)
-    all_gdf.set_index("row_id", inplace = True)
-
-    all_gdf["area_sqkm"] = all_gdf["geometry"].area/10**6
-    all_gdf["length_km"] = all_gdf["geometry"].length/1000
-    # all_gdf = gpd.GeoDataFrame(all_gdf, geometry=all_gdf.geometry, 
-    #                             crs=proj)
+    if batch_size is not None:
+        if outfile is None:
+            raise ValueError("Expected output file path to stream merged " +
+                             "batches to, but got None")
+        if Path(str(outfile)).suffix.lower() != ".gpkg" and \
+           not is_parquet(str(outfile)):
+            raise ValueError("Expected GeoPackage or GeoParquet output file " +
+                             "to stream merged batches to, but got " +
+                             str(outfile))
+        count = write(iter_merged(inlist, proj, batch_size), outfile,
+                      overwrite)
+        if count is not None:
+            print(str(count) + " features merged from " + str(len(inlist)) +
+                  " inputs")
+        if return_merged:
+            return load(str(outfile)).set_index("row_id")
+        return outfile
+
+    all_gdf = merge_frames(load_all(inlist), proj)
 
     if outfile is not None:
-        if os.path.isfile(outfile):
-            if overwrite:
-                print("Overwriting existing file")
-                all_gdf.to_file(outfile)
-                print("Overwritten file saved to " + str(outfile))
-            else:
-                print("File exists and will not be overwritten. Moving to next file")
-        else:
-            print("Writing new file")
-            all_gdf.to_file(outfile)
-            print("New file saved to "+str(outfile))
+        write(all_gdf, outfile, overwrite)
           
     return all_gdf
 
+def iter_merged(inlist, proj="EPSG:3413", batch_size=1):
+    """Yield merged batches of inputs, read batch_size inputs at a time, with
+    row IDs numbered across all inputs. Metadata columns are plain strings,
+    so that every batch (even an empty one) has the same column types"""
+    offset = 0
+    for i in range(0, len(inlist), batch_size):
+        batch = merge_frames(load_all(inlist[i:i+batch_size]), proj, offset)
+        batch = batch.astype({c: "string" for c in COLUMNS})
+        offset += batch.shape[0]
+        yield batch
+
+def merge_frames(frames, proj="EPSG:3413", offset=None):
+    """Merge loaded inputs into one geodataframe, with row IDs numbered
+    within each input, or from offset across all inputs if given"""
+    geoms = [f.geometry.values for f in frames]
+    if offset is None:
+        row_id = np.concatenate([np.arange(1, len(g)+1) for g in geoms])
+    else:
+        row_id = np.arange(offset+1, offset+sum(len(g) for g in geoms)+1)
+
+    # Construct merged geodataframe from one geometry array and categorical
+    # metadata columns
+    all_gdf = gpd.GeoDataFrame(
+        {c: concat_categorical([f[c] for f in frames]) for c in COLUMNS},
+        geometry=np.concatenate([np.asarray(g) for g in geoms]), crs=proj,
+        index=pd.Index(row_id, name="row_id"))
+    all_gdf = all_gdf[["geometry"] + COLUMNS]
+
+    all_gdf["area_sqkm"] = shapely.area(all_gdf.geometry.values)/10**6
+    all_gdf["length_km"] = shapely.length(all_gdf.geometry.values)/1000
+    return all_gdf
+
 def load_all(inlist):
-    """Load info from all features for merging
+    """Load geometries and metadata columns of all features for merging
 
     Parameters
     ----------
@@ -80,30 +115,27 @@ def load_all(inlist):
 
     Returns
     -------
-    feature_list : list
-        List of shapely features
-    method_list : list
-        List of strings denoting processing method
-    collection_list : list
-        List of strings denoting dataset collection
-    date_list : list
-        List of start and end date for processing
+    frames : list
+        List of geopandas.GeoDataFrame objects with geometry, method, source,
+        start date and end date columns only
     """ 
-    features=[]
-    methods=[]
-    sources=[]
-    starts=[]
-    ends=[]
-    
+    frames=[]
     for f in inlist:
-        i = load(f)
-        features.append(list(i["geometry"]))
-        methods.append(list(i["method"]))
-        sources.append(list(i["source"]))
-        starts.append(list(i["startdate"]))
-        ends.append(list(i["enddate"]))
-    
-    return features, methods, sources, starts, ends
+        if type(f)==str:
+            i = load(f, columns=COLUMNS)
+        else:
+            i = load(f)
+        frames.append(i[COLUMNS + [i.geometry.name]])
+    return frames
+
+def concat_categorical(columns):
+    """Concatenate columns into one categorical column, combining the
+    categories of each"""
+    try:
+        return union_categoricals([pd.Categorical(c) for c in columns])
+    except TypeError:
+        return pd.Categorical(np.concatenate([c.to_numpy(dtype=object)
+                                              for c in columns]))
 
 def dissolve_vectors(gdf):
     """Dissolve overlapping polygons in a Pandas GeoDataFrame
@@ -1,13 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os
-from griml.load import load
+
+import time
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import shapely
+from scipy.sparse.csgraph import connected_components
+from griml.load import load, write
 from griml.metadata import assign_id, assign_sources, assign_certainty, \
     assign_names, assign_regions
+from griml.metadata.assign_id import get_overlap_graph
+from griml.metadata.assign_sources import get_sources
+from griml.metadata.assign_certainty import get_certainty, get_score_table
+from griml.metadata.assign_regions import get_region_index, \
+    get_region_raster, get_region_values
+from griml.metadata.assign_names import get_placename_index, get_placenames
 
-__all__ = ["add_metadata"]
+__all__ = ["add_metadata", "add_metadata_series"]
 
-def add_metadata(iml, names, regions, outfile=None, overwrite=False):
+def add_metadata(iml, names, regions, outfile=None, overwrite=False,
+                 scores=None, fused=True, cell_size=None):
     """Add all metadata information to inventory
 
     Parameters
@@ -22,6 +36,16 @@ def add_metadata(iml, names, regions, outfile=None, overwrite=False):
         Filepath for output to be saved to
     overwrite : bool, optional
         Flag whether to overwrite existing file
+    scores : dict, optional
+        Table of certainty score per source name. If None, the default scores
+        for S1, S2 and ARCTICDEM are used
+    fused : bool, optional
+        Flag to add all metadata in a single pass, computing centroids once
+        and writing attribute columns in place, with per-step timings
+        reported. Otherwise each metadata step is run on its own
+    cell_size : float, optional
+        Cell size of region lookup raster, for assigning regions. If None,
+        regions are assigned from exact region geometries
 
     Returns
     -------
@@ -29,40 +53,206 @@ def add_metadata(iml, names, regions, outfile=None, overwrite=False):
         Inventory GeoDataFrame with metadata
     """
     iml = load(iml)
-    names = load(names)
-    regions = load(regions)
-    
-    print("Assigning ID...")
-    iml = assign_id(iml)
+
+    if fused:
+        lookup = None if cell_size is None else \
+            get_region_raster(regions, cell_size)
+        iml = add_metadata_fused(iml, names, regions, scores, lookup)
+
+    else:
+        print("Assigning ID...")
+        iml = assign_id(iml)
         
-    print("Assigning sources...")
-    iml = assign_sources(iml)
+        print("Assigning sources...")
+        iml = assign_sources(iml)
+        
+        print("Assigning certainty scores...")
+        iml = assign_certainty(iml, scores)
+
+        print("Assigning regions...")
+        iml = assign_regions(iml, regions, cell_size=cell_size)
         
+        print("Assigning placenames...")
+        iml = assign_names(iml, names)
+
+    if outfile is not None:
+        write(iml, outfile, overwrite)
+
+    return iml
+
+def add_metadata_series(inlist, names, regions, outfiles=None,
+                        overwrite=False, scores=None, workers=None,
+                        cell_size=None):
+    """Add all metadata information to a series of inventories (such as one
+    per year), building the placename and region indexes only once
+
+    Parameters
+    ----------
+    inlist : list
+        List of inventory filepaths or GeoDataFrame objects
+    names : geopandas.GeoDataFrame or str
+        Placenames database GeoDataFrame object or filepath
+    regions : geopandas.GeoDataFrame or str
+        Regions identifier GeoDataFrame object or filepath
+    outfiles : list, optional
+        Filepaths for each inventory output to be saved to
+    overwrite : bool, optional
+        Flag whether to overwrite existing files
+    scores : dict, optional
+        Table of certainty score per source name. If None, the default scores
+        for S1, S2 and ARCTICDEM are used
+    workers : int, optional
+        Number of worker processes to add metadata with. If greater than 1,
+        inventories that fail are reported and returned as None, and if
+        outfiles are given the output file paths are returned instead of the
+        inventories
+    cell_size : float, optional
+        Cell size of region lookup raster, for assigning regions. If None,
+        regions are assigned from exact region geometries
+
+    Returns
+    -------
+    out : list
+        Inventories with metadata (or output file paths), in input order
+    """
+    if outfiles is None:
+        outfiles = [None] * len(inlist)
+    if len(outfiles) != len(inlist):
+        raise ValueError("Expected one output filepath per inventory, but " +
+                         "got " + str(len(outfiles)) + " for " +
+                         str(len(inlist)) + " inventories")
+
+    # Build reference indexes once for all inventories
+    print("Building placename and region indexes...")
+    names = get_placename_index(names)
+    lookup = None if cell_size is None else \
+        get_region_raster(regions, cell_size)
+    regions = get_region_index(regions)
+
+    # Iterate through inventories
+    if workers is None or workers < 2:
+        out = []
+        for count, (i, o) in enumerate(zip(inlist, outfiles), start=1):
+            print("\n" + str(count) + ". Adding metadata to " + get_label(i))
+            out.append(add_metadata_file(i, o, overwrite, scores, names,
+                                         regions, lookup))
+        return out
+
+    # Or distribute inventories across worker processes, which receive the
+    # reference indexes once on start-up and write their own outputs
+    out = []
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=init_worker,
+                             initargs=(names, regions, lookup)) as pool:
+        futures = [pool.submit(add_metadata_file, i, o, overwrite, scores,
+                               return_path=o is not None)
+                   for i, o in zip(inlist, outfiles)]
+        for count, (i, f) in enumerate(zip(inlist, futures), start=1):
+            try:
+                g = f.result()
+                print("\n" + str(count) + ". Added metadata to " +
+                      get_label(i))
+            except Exception as e:
+                print("\n" + str(count) + ". Failed to add metadata to " +
+                      get_label(i) + ": " + str(e))
+                g = None
+            out.append(g)
+    return out
+
+# Reference indexes of worker process, set on start-up
+_WORKER = {}
+
+def init_worker(names, regions, lookup):
+    """Set reference indexes of worker process, re-preparing geometries"""
+    shapely.prepare(regions.geoms)
+    _WORKER.update(names=names, regions=regions, lookup=lookup)
+
+def add_metadata_file(infile, outfile=None, overwrite=False, scores=None,
+                      names=None, regions=None, lookup=None,
+                      return_path=False):
+    """Add metadata to a single inventory, returning either the inventory or
+    the output file path"""
+    if names is None:
+        names, regions, lookup = itemgetter("names", "regions",
+                                            "lookup")(_WORKER)
+    if isinstance(infile, Path):
+        infile = str(infile)
+    iml = add_metadata_fused(load(infile), names, regions, scores, lookup)
+    if outfile is not None:
+        write(iml, outfile, overwrite)
+        if return_path:
+            return outfile
+    return iml
+
+def get_label(i):
+    """Get label of inventory filepath or object for progress messages"""
+    if isinstance(i, (str, Path)):
+        return str(Path(i).name)
+    return "inventory of " + str(len(i)) + " features"
+
+def add_metadata_fused(iml, names, regions, scores=None, lookup=None):
+    """Add all metadata to inventory in a single pass, sharing centroids
+    between steps and reordering rows once at the end"""
+    timings = {}
+    start = time.perf_counter()
+
+    def lap(step):
+        """Record and report time taken by step"""
+        nonlocal start
+        now = time.perf_counter()
+        timings[step] = now - start
+        print(step + " took " + format(timings[step], ".2f") + " s")
+        start = now
+
+    print("Assigning ID...")
+    n, ids = connected_components(get_overlap_graph(iml.geometry))
+    ids = ids + 1
+    iml["lake_id"] = ids
+    lap("ID")
+
+    print("Assigning sources...")
+    all_src, num_src = get_sources(ids, iml["source"])
+    iml["all_src"] = all_src
+    iml["num_src"] = num_src
+    lap("Sources")
+
     print("Assigning certainty scores...")
-    n = ["S1","S2","ARCTICDEM"]
-    scores = [0.298, 0.398, 0.304]
-    iml = assign_certainty(iml, n, scores)
+    iml["certainty"] = get_certainty(all_src, get_score_table(scores))
+    lap("Certainty")
+
+    # Centroids of valid geometries, shared by region and placename lookups
+    geoms = iml.geometry.values
+    valid = np.flatnonzero(~geoms.isna())
+    centroids = geoms[valid].centroid
+    lap("Centroids")
 
     print("Assigning regions...")
-    iml = assign_regions(iml, regions)
-        
+    index = get_region_index(regions)
+    iml["subregion"] = expand(get_region_values(
+        centroids, index, lookup=lookup)["subregion"], valid, len(iml))
+    lap("Regions")
+
     print("Assigning placenames...")
-    iml = assign_names(iml, names)
+    iml["placename"] = expand(get_placenames(
+        centroids, get_placename_index(names)), valid, len(iml))
+    lap("Placenames")
 
-    if outfile is not None:
-        if os.path.isfile(outfile):
-            if overwrite:
-                print("Overwriting existing file")
-                iml.to_file(outfile)
-                print("Overwritten file saved to " + str(outfile))
-            else:
-                print("File exists and will not be overwritten. Moving to next file")
-        else:
-            print("Writing new file")
-            iml.to_file(outfile)
-            print("New file saved to " + str(outfile))
+    # Drop invalid geometries and sort by lake ID in a single copy
+    order = valid[np.argsort(ids[valid], kind="stable")]
+    iml = iml.take(order)
+    iml.reset_index(inplace=True, drop=True)
+    lap("Sorting")
 
+    iml.attrs["timings"] = timings
+    print("Metadata assigned in " + format(sum(timings.values()), ".2f") +
+          " s")
     return iml
+
+def expand(values, positions, n):
+    """Expand values at given positions to array of length n"""
+    out = np.full(n, None, dtype=object)
+    out[positions] = values
+    return out
         
         
 if __name__ == "__main__": 
@@ -1,19 +1,27 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import numpy as np
+import pandas as pd
+
 __all__ = ["assign_certainty"]
 
-def assign_certainty(gdf, search_names, scores, source="all_src"):
+# Default certainty score of each source
+SCORES = {"S1": 0.298, "S2": 0.398, "ARCTICDEM": 0.304}
+
+def assign_certainty(gdf, search_names=None, scores=None, source="all_src"):
     """Assign certainty score to geodataframe based on sources
-    
+
     Parameters
     ----------
     gdf : geopandas.GeoDataFrame
         Vectors to assign certainty to
-    search_names : str
-        Names of sources to count and determine certainty
-    scores : list
-        List of scores of certainty
+    search_names : list or dict, optional
+        Names of sources to count and determine certainty, or a table of
+        source name to certainty score. If None, the default score table is
+        used
+    scores : list, optional
+        List of scores of certainty, matching search_names
     sources : str
         Column name of sources information
 
@@ -22,31 +30,38 @@ def assign_certainty(gdf, search_names, scores, source="all_src"):
     gdf : geopandas.GeoDataFrame
         Vectors with certainty metadata assigned
     """
-    cert=[]
-    srcs = list(gdf[source])
-
-    for a in range(len(srcs)):
-        if srcs[a].split(", ")==1:
-            out = _get_score(srcs.split(", "))
-            cert.append(out)    
-        else:
-            out=[]
-            for b in srcs[a].split(", "):
-                out.append(get_score(b,
-                                     search_names,
-                                     scores))
-            cert.append(sum(out))
-
-    gdf["certainty"] = cert
+    table = get_score_table(search_names, scores)
+    gdf["certainty"] = get_certainty(gdf[source], table)
     return gdf
 
-def get_score(value, search_names, scores):
-    """Determine score from search string"""
-    if search_names[0] in value:
-        return scores[0]
-    elif search_names[1] in value:
-        return scores[1]
-    elif search_names[2] == value:
-        return scores[2]
-    else:
-        return None
+def get_certainty(src_values, table):
+    """Get certainty score of each source list from table of scores"""
+    names = list(table.keys())
+    weights = np.array(list(table.values()), dtype=float)
+
+    # Score each distinct source list once, then broadcast to all vectors
+    codes, combos = pd.factorize(src_values)
+    masks = get_source_masks(combos, names)
+    cert = np.append(masks @ weights, np.nan)
+    return cert[codes]
+
+def get_score_table(search_names=None, scores=None):
+    """Get table of certainty score per source name"""
+    if search_names is None:
+        return dict(SCORES)
+    if isinstance(search_names, dict):
+        return dict(search_names)
+    if scores is None or len(scores) != len(search_names):
+        raise ValueError("Expected one score per source name, but got " +
+                         str(search_names) + " and " + str(scores))
+    return dict(zip(search_names, scores))
+
+def get_source_masks(combos, names):
+    """Get boolean matrix of which named sources are in each source list"""
+    lookup = {n: i for i, n in enumerate(names)}
+    masks = np.zeros((len(combos), len(names)), dtype=bool)
+    for a, c in enumerate(combos):
+        for b in str(c).split(", "):
+            if b in lookup:
+                masks[a, lookup[b]] = True
+    return masks
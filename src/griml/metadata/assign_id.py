@@ -1,37 +1,166 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import shapely
+from scipy.sparse import csr_matrix
 from scipy.sparse.csgraph import connected_components
+from griml.load import load
 
 __all__ = ["assign_id"]
 
-def assign_id(gdf, col_name="lake_id"):
+def assign_id(gdf, col_name="lake_id", tile_size=None, grid=None,
+              workers=None):
     """Assign unique identification numbers to non-overlapping geometries in
     geodataframe
-    
+
     Parameters
     ----------
     gdf : geopandas.GeoDataFrame
         Vectors to assign identification numbers to
     col_name : str
         Column name to assign ID from
-    
+    tile_size : float, optional
+        Size of square grid tiles (in units of the vectors projection) to
+        partition vectors by, finding overlapping geometries per tile and
+        merging components across tile seams. IDs are the same as without
+        partitioning
+    grid : geopandas.GeoDataFrame or str, optional
+        Grid of tile polygons (such as AOI tiles) to partition vectors by,
+        instead of square tiles
+    workers : int, optional
+        Number of worker processes to find overlapping geometries in tiles
+        with, if tile_size or grid is given
+
     Returns
     -------
     gdf : geopandas.GeoDataFrame
         Vectors with assigned IDs
     """
-    # Find overlapping geometries
-    geoms = gdf["geometry"]
-    geoms.reset_index(inplace=True, drop=True)        
-    overlap_matrix = geoms.apply(lambda x: geoms.overlaps(x)).values.astype(int)
-    
-    # Get unique ids for non-overlapping geometries
-    n, ids = connected_components(overlap_matrix)
+    if tile_size is None and grid is None:
+
+        # Find overlapping geometries
+        overlap_graph = get_overlap_graph(gdf.geometry)
+
+        # Get unique ids for non-overlapping geometries
+        n, ids = connected_components(overlap_graph)
+
+    else:
+        ids = get_tiled_components(gdf.geometry.values, tile_size, grid,
+                                   workers)
     ids=ids+1
-    
-    # Assign ids and realign geodataframe index 
+
+    # Assign ids and realign geodataframe index
     gdf[col_name]=ids
-    gdf = gdf.sort_values(col_name)
-    gdf.reset_index(inplace=True, drop=True) 
+    gdf = gdf.sort_values(col_name, kind="stable")
+    gdf.reset_index(inplace=True, drop=True)
     return gdf
+
+def get_overlap_graph(geoms):
+    """Build sparse adjacency matrix of overlapping geometries from a spatial
+    index bulk query"""
+    n = len(geoms)
+    left, right = geoms.sindex.query(geoms.values, predicate="overlaps")
+    return csr_matrix((np.ones(len(left), dtype=np.int8), (left, right)),
+                      shape=(n, n))
+
+def get_tiled_components(geoms, tile_size=None, grid=None, workers=None):
+    """Get component labels of overlapping geometries, found per tile and
+    merged across tile seams, numbered as by connected_components"""
+    n = len(geoms)
+    tiles = get_home_tiles(geoms, tile_size, grid)
+    tree = shapely.STRtree(geoms)
+
+    # Gather home geometries of each tile, and all geometries near them
+    tasks = []
+    order = np.argsort(tiles, kind="stable")
+    starts = np.flatnonzero(np.diff(tiles[order], prepend=-2))
+    for home in np.split(order, starts[1:]):
+        if tiles[home[0]] < 0:
+            continue
+        near = tree.query(shapely.box(*shapely.total_bounds(geoms[home])))
+        near = np.setdiff1d(near, home, assume_unique=True)
+        idx = np.concatenate([home, near])
+        tasks.append((idx, geoms[idx], len(home)))
+
+    # Find components per tile, in worker processes or in turn
+    if workers is None or workers < 2:
+        results = [get_tile_roots(*t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(get_tile_roots, *zip(*tasks)))
+
+    # Merge components sharing geometries across tiles
+    if len(results) > 0:
+        left = np.concatenate([r[0] for r in results])
+        right = np.concatenate([r[1] for r in results])
+    else:
+        left = right = np.zeros(0, dtype=np.int64)
+    roots = union_find(n, left, right)
+    return np.unique(roots, return_inverse=True)[1].astype(np.int32)
+
+def get_home_tiles(geoms, tile_size=None, grid=None):
+    """Get home tile of each geometry from the centre of its bounds, or -1
+    for missing geometries"""
+    b = shapely.bounds(geoms)
+    x = (b[:,0] + b[:,2]) / 2
+    y = (b[:,1] + b[:,3]) / 2
+    valid = ~np.isnan(x)
+    tiles = np.full(len(geoms), -1, dtype=np.int64)
+    if not valid.any():
+        return tiles
+
+    if grid is None:
+        col = np.floor((x[valid] - np.min(x[valid])) / tile_size)
+        row = np.floor((y[valid] - np.min(y[valid])) / tile_size)
+        tiles[valid] = (row * (np.max(col) + 1) + col).astype(np.int64)
+
+    else:
+        # Tile containing bounds centre, otherwise nearest tile
+        cells = load(grid).geometry.values
+        pts = shapely.points(x[valid], y[valid])
+        home = np.full(len(pts), -1, dtype=np.int64)
+        a, c = shapely.STRtree(cells).query(pts, predicate="intersects")
+        first = np.unique(a, return_index=True)[1]
+        home[a[first]] = c[first]
+        rest = np.flatnonzero(home < 0)
+        if len(rest) > 0:
+            a, c = shapely.STRtree(cells).query_nearest(pts[rest],
+                                                        all_matches=False)
+            home[rest[a]] = c
+        tiles[valid] = home
+    return tiles
+
+def get_tile_roots(idx, geoms, n_home):
+    """Get each geometry of tile and the lowest index of its component, from
+    overlaps of the tile home geometries"""
+    left, right = shapely.STRtree(geoms).query(geoms[:n_home],
+                                               predicate="overlaps")
+    n = len(geoms)
+    graph = csr_matrix((np.ones(len(left), dtype=np.int8), (left, right)),
+                       shape=(n, n))
+    k, labels = connected_components(graph)
+    lowest = np.full(k, np.iinfo(np.int64).max)
+    np.minimum.at(lowest, labels, idx)
+    return idx, lowest[labels]
+
+def union_find(n, left, right):
+    """Get lowest index of the set of each of n elements, merging sets of
+    each pair of elements by hooking onto the lowest root with path
+    compression"""
+    roots = np.arange(n)
+    while True:
+        low = np.minimum(roots[left], roots[right])
+        hooked = roots.copy()
+        np.minimum.at(hooked, roots[left], low)
+        np.minimum.at(hooked, roots[right], low)
+        hooked = hooked[hooked]
+        while True:
+            compressed = hooked[hooked]
+            if np.array_equal(compressed, hooked):
+                break
+            hooked = compressed
+        if np.array_equal(hooked, roots):
+            return roots
+        roots = hooked
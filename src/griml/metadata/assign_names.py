@@ -1,18 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import itertools
+import itertools, os
+from collections import namedtuple
 from operator import itemgetter
 
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+import shapely
 
 from scipy.spatial import cKDTree
 from shapely.geometry import Point, LineString, Polygon
 from griml.load import load
+from griml.load.cache import cached_build, get_file_hash
 
-__all__ = ["assign_names"]
+__all__ = ["assign_names", "get_placename_index"]
 
 def assign_names(gdf, gdf_names, distance=1000.0):
     """Assign placenames to geodataframe geometries based on names in another 
@@ -22,8 +25,9 @@ def assign_names(gdf, gdf_names, distance=1000.0):
     ----------
     gdf : geopandas.GeoDataFrame
         Vectors to assign uncertainty to
-    gdf_names : geopandas.GeoDataFrame
-        Vector geodataframe with placenames
+    gdf_names : geopandas.GeoDataFrame, str or PlacenameIndex
+        Vector geodataframe with placenames, placenames filepath, or prebuilt
+        placename index
     distance : int
         Distance threshold between a given vector and a placename
     
@@ -33,44 +37,101 @@ def assign_names(gdf, gdf_names, distance=1000.0):
         Vectors with assigned IDs
     """  
     
-    # Load geodataframes
+    # Load geodataframe and placename index
     gdf1 = load(gdf)
-    gdf2 = load(gdf_names)
-    
-    # Compile placenames into new dataframe
-    names = compile_names(gdf2)
-    placenames = gpd.GeoDataFrame({"geometry": list(gdf2["geometry"]),
-                                   "placename": names})
+    index = get_placename_index(gdf_names)
     
     # Remove invalid geometries
     gdf1 = check_geometries(gdf1)
                                     
     # Assign names based on proximity
-    a = get_nearest_point(gdf1, placenames, distance)
+    a = get_nearest_point(gdf1, index, distance)
     
     return a
 
 
-def get_nearest_point(gdA, gdB, distance=1000.0):
-    """Return properties of nearest point in Y to geometry in X"""
-    nA = np.array(list(gdA.geometry.centroid.apply(lambda x: (x.x, x.y))))
-    nB = np.array(list(gdB.geometry.apply(lambda x: (x.x, x.y))))
-
-    btree = cKDTree(nB)
-    dist, idx = btree.query(nA, k=1)
-    gdB_nearest = gdB.iloc[idx].drop(columns="geometry").reset_index(drop=True)
-    gdf = pd.concat(
-        [
-            gdA.reset_index(drop=True),
-            gdB_nearest,
-            pd.Series(dist, name="dist")
-        ], 
-        axis=1)
-    
-    gdf.loc[gdf["dist"]>=distance, "placename"] = "Unknown"
-    gdf = gdf.drop(columns=["dist"])    
+# Placename index, as preferred names, point coordinates and KD-tree
+PlacenameIndex = namedtuple("PlacenameIndex", ["names", "coords", "tree"])
+
+# Version of the placename index sidecar file format
+INDEX_VERSION = 2
+
+def get_placename_index(gdf_names, save=True):
+    """Get placename index from placenames geodataframe or file, reading it 
+    from (or saving it to) a sidecar file next to the placenames file"""
+    if isinstance(gdf_names, PlacenameIndex):
+        return gdf_names
+    if not isinstance(gdf_names, str):
+        return build_placename_index(load(gdf_names))
+    return cached_build(gdf_names, ("placename_index",),
+                        lambda: read_placename_sidecar(gdf_names, save))
+
+def read_placename_sidecar(gdf_names, save=True):
+    """Read placename index from sidecar file if it was built from the same
+    placenames file, or otherwise build index and save sidecar"""
+    checksum = get_file_hash(gdf_names)
+    sidecar = gdf_names + ".idx.npz"
+    index = None
+    if os.path.isfile(sidecar):
+        try:
+            index = read_placename_index(sidecar, checksum)
+        except Exception:
+            index = None
+
+    if index is None:
+        index = build_placename_index(load(gdf_names, cache=True))
+        if save:
+            try:
+                save_placename_index(index, sidecar, checksum)
+            except OSError:
+                print("Could not save placename index to " + sidecar)
+    return index
+
+def build_placename_index(gdf):
+    """Build placename index from placenames geodataframe"""
+    names = compile_names(gdf)
+    coords = shapely.get_coordinates(gdf.geometry.values)
+    return PlacenameIndex(names, coords, cKDTree(coords))
+
+def read_placename_index(infile, checksum):
+    """Read placename index from sidecar file, rebuilding its KD-tree, or
+    return None if it is outdated"""
+    with np.load(infile, allow_pickle=False) as saved:
+        if int(saved["version"])!=INDEX_VERSION or \
+            str(saved["hash"])!=checksum:
+            return None
+        names = saved["names"].astype(object)
+        names[saved["missing"]] = None
+        coords = saved["coords"]
+    return PlacenameIndex(names, coords, cKDTree(coords))
+
+def save_placename_index(index, outfile, checksum):
+    """Save placename names and coordinates to sidecar file, with the version
+    and placenames file hash"""
+    missing = pd.isna(index.names)
+    names = np.where(missing, "", index.names).astype(str)
+    tmpfile = outfile + ".tmp"
+    with open(tmpfile, "wb") as f:
+        np.savez(f, version=INDEX_VERSION, hash=checksum, names=names,
+                 missing=missing, coords=index.coords)
+    os.replace(tmpfile, outfile)
+
+def get_nearest_point(gdA, index, distance=1000.0):
+    """Return name of nearest point in placename index to geometry in X"""
+    gdf = gdA.reset_index(drop=True)
+    gdf["placename"] = get_placenames(gdf.geometry.centroid.values, index,
+                                      distance)
     return gdf
 
+def get_placenames(points, index, distance=1000.0):
+    """Get name of nearest point in placename index to each point"""
+    if len(index.names)==0:
+        return np.full(len(points), "Unknown", dtype=object)
+    dist, idx = index.tree.query(shapely.get_coordinates(points), k=1)
+    names = index.names[idx]
+    names[dist>=distance] = "Unknown"
+    return names
+
 def get_indices(mylist, value):
     """Get indices for value in list"""
     return[i for i, x in enumerate(mylist) if x==value]
@@ -81,20 +142,13 @@ def check_geometries(gdf):
     return gdf.drop(gdf[gdf.geometry==None].index)
 
 def compile_names(gdf):
-    """Get preferred placenames from placename geodatabase"""  
-    placenames=[]
-    for i,v in gdf.iterrows():
-        if v["New Greenl"] != None: 
-            placenames.append(v["New Greenl"])
-        else:
-            if v["Old Greenl"] != None: 
-                placenames.append(v["Old Greenl"])
-            else:
-            	if v["Danish"] != None: 
-                    placenames.append(v["Danish"])
-            	else:
-                    if v["Alternativ"] != None:
-                        placenames.append(v["Alternativ"])
-                    else:
-                        placenames.append(None)
-    return placenames
+    """Get preferred placenames from placename geodatabase, in order of new
+    Greenlandic, old Greenlandic, Danish and alternative names"""
+    cols = [c for c in ["New Greenl", "Old Greenl", "Danish", "Alternativ"]
+            if c in gdf.columns]
+    names = np.full(len(gdf), None, dtype=object)
+    for c in reversed(cols):
+        values = gdf[c].to_numpy(dtype=object)
+        valid = pd.notna(values)
+        names[valid] = values[valid]
+    return names
@@ -1,25 +1,42 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import itertools
-from operator import itemgetter
+import os
+from collections import namedtuple
 import numpy as np
 import pandas as pd
+import rasterio
+import shapely
+from rasterio.enums import MergeAlg
+from rasterio.features import rasterize
+from rasterio.transform import from_origin
 from griml.load import load
-from scipy.spatial import cKDTree
+from griml.load.cache import cached_build, get_file_hash
 
-__all__ = ["assign_regions"]
+__all__ = ["assign_regions", "get_region_index", "get_region_raster"]
 
-def assign_regions(gdf, gdf_regions):
+def assign_regions(gdf, gdf_regions, distance=100000.0, cell_size=None):
     """Assign region to geodataframe geometries based on regions in another 
     geodataframe object
 
+    Geometries are assigned the region that contains their centroid. Any
+    geometries outside of all regions are assigned the nearest region within
+    the distance threshold, or otherwise "Unknown"
+
     Parameters
     ----------
     gdf : geopandas.GeoDataFrame
         Vectors to assign region name to
-    gdf_regions : pandas.GeoDataFrame
-        Vector geodataframe with regions
+    gdf_regions : geopandas.GeoDataFrame, str or RegionIndex
+        Vector geodataframe with regions, regions filepath, or prebuilt region
+        index
+    distance : float, optional
+        Distance threshold between a given vector and its nearest region
+    cell_size : float, optional
+        Cell size of region lookup raster. If given, centroids are classified
+        by indexing a lookup raster of the regions (saved alongside the
+        regions file), with exact region geometries only used for centroids
+        in region border cells or outside of all regions
     
     Returns
     -------
@@ -27,46 +44,258 @@ def assign_regions(gdf, gdf_regions):
         Vectors with assigned IDs
     """                                      
 
-    # Load geodataframes
+    # Load geodataframe and region index
     gdf1 = load(gdf)
-    gdf2 = load(gdf_regions)
+    index = get_region_index(gdf_regions)
     
-    g = get_nearest_polygon(gdf1, gdf2)
+    if cell_size is None:
+        g = get_nearest_polygon(gdf1, index, distance=distance)
+    else:
+        lookup = get_region_raster(gdf_regions, cell_size)
+        g = get_nearest_polygon(gdf1, index, distance=distance,
+                                lookup=lookup)
 
     return g
 
 
+# Region index, as region properties, prepared geometries, STRtree and code
+# of each region's property values
+RegionIndex = namedtuple("RegionIndex", ["values", "geoms", "tree",
+                                         "groups"])
+
+def get_region_index(gdf_regions, cols=["subregion"]):
+    """Get region index from regions geodataframe or file, reusing indexes of
+    unchanged region files between calls
+
+    Parameters
+    ----------
+    gdf_regions : geopandas.GeoDataFrame, str or RegionIndex
+        Vector geodataframe with regions, regions filepath, or prebuilt region
+        index
+    cols : list, optional
+        Region property columns to assign
+
+    Returns
+    -------
+    index : RegionIndex
+        Region properties, prepared region geometries, their spatial index
+        and the code of each region's property values
+    """
+    if isinstance(gdf_regions, RegionIndex):
+        return gdf_regions
+    if not isinstance(gdf_regions, str):
+        return build_region_index(load(gdf_regions), cols)
+
+    return cached_build(gdf_regions, ("region_index", tuple(cols)),
+                        lambda: build_region_index(
+                            load(gdf_regions, cache=True), cols))
+
+def build_region_index(gdf, cols=["subregion"]):
+    """Build region index from regions geodataframe"""
+    geoms = gdf.geometry.values.copy()
+    shapely.prepare(geoms)
+    values = {c: gdf[c].to_numpy(dtype=object) for c in cols}
+    groups = pd.DataFrame(values).groupby(list(cols), sort=False,
+                                          dropna=False).ngroup().to_numpy()
+    return RegionIndex(values, geoms, shapely.STRtree(geoms), groups)
+
+# Region lookup raster, as region codes, origin and cell size
+RegionRaster = namedtuple("RegionRaster", ["codes", "x0", "y0", "cell_size"])
+
+# Lookup raster codes for cells outside of all regions and region borders
+OUTSIDE = 0
+BORDER = 255
+
+# Version of the region lookup raster sidecar file format
+RASTER_VERSION = 2
+
+def get_region_raster(gdf_regions, cell_size=1000.0, save=True,
+                      cols=["subregion"]):
+    """Get region lookup raster from regions geodataframe, file or index,
+    reading it from (or saving it to) a sidecar GeoTIFF next to the regions
+    file
+
+    Each cell holds the code of the region property values (one plus the
+    code in the region index) covering it, 0 if outside of all regions, or
+    255 if a border between region values passes through the cell. Border
+    cells are refined with exact region geometries on lookup
+
+    Parameters
+    ----------
+    gdf_regions : geopandas.GeoDataFrame, str or RegionIndex
+        Vector geodataframe with regions, regions filepath, or prebuilt region
+        index
+    cell_size : float, optional
+        Lookup raster cell size, in units of the regions projection
+    save : bool, optional
+        Flag to save lookup raster next to the regions file
+    cols : list, optional
+        Region property columns to encode, as in the region index
+
+    Returns
+    -------
+    lookup : RegionRaster
+        Region codes, upper-left origin and cell size of lookup raster
+    """
+    if isinstance(gdf_regions, RegionRaster):
+        return gdf_regions
+    if not isinstance(gdf_regions, str):
+        return build_region_raster(get_region_index(gdf_regions, cols),
+                                   cell_size)
+    return cached_build(gdf_regions, ("region_raster", float(cell_size),
+                                      tuple(cols)),
+                        lambda: read_region_sidecar(gdf_regions, cell_size,
+                                                    save, cols))
+
+def read_region_sidecar(gdf_regions, cell_size=1000.0, save=True,
+                        cols=["subregion"]):
+    """Read region lookup raster from sidecar GeoTIFF if it was built from
+    the same regions file, or otherwise build raster and save sidecar"""
+    checksum = get_file_hash(gdf_regions)
+    sidecar = gdf_regions + "." + repr(float(cell_size)) + "m.lookup.tif"
+    lookup = None
+    if os.path.isfile(sidecar):
+        try:
+            with rasterio.open(sidecar) as src:
+                tags = src.tags()
+                if tags.get("version") == str(RASTER_VERSION) and \
+                   tags.get("source_hash") == checksum and \
+                   tags.get("columns") == ",".join(cols) and \
+                   src.transform.a == float(cell_size):
+                    lookup = RegionRaster(src.read(1), src.transform.c,
+                                          src.transform.f, src.transform.a)
+        except rasterio.errors.RasterioError:
+            lookup = None
+
+    if lookup is None:
+        lookup = build_region_raster(get_region_index(gdf_regions, cols),
+                                     cell_size)
+        if save:
+            try:
+                save_region_raster(lookup, sidecar,
+                                   load(gdf_regions, cache=True).crs,
+                                   checksum, cols)
+            except (OSError, rasterio.errors.RasterioError):
+                print("Could not save region lookup raster to " + sidecar)
+    return lookup
+
+def build_region_raster(index, cell_size=1000.0):
+    """Build region lookup raster from region index"""
+    n = int(index.groups.max()) + 1 if len(index.groups) > 0 else 0
+    if n >= BORDER:
+        raise ValueError("Expected fewer than " + str(BORDER) + " region " +
+                         "values for lookup raster, but got " + str(n))
+    geoms = index.geoms
+    valid = ~(shapely.is_missing(geoms) | shapely.is_empty(geoms))
+    xmin, ymin, xmax, ymax = shapely.total_bounds(geoms[valid])
+    x0 = np.floor(xmin / cell_size) * cell_size
+    y0 = np.ceil(ymax / cell_size) * cell_size
+    shape = (max(int(np.ceil((y0 - ymin) / cell_size)), 1),
+             max(int(np.ceil((xmax - x0) / cell_size)), 1))
+    transform = from_origin(x0, y0, cell_size, cell_size)
+
+    # Burn region value codes by cell centre
+    codes = rasterize(zip(geoms[valid], index.groups[valid] + 1),
+                      out_shape=shape, transform=transform, fill=OUTSIDE,
+                      dtype="uint8")
+
+    # Mark cells covered by several region values, or touching the border of
+    # a region value, so borders between regions of one value are ignored
+    dissolved = [shapely.union_all(geoms[valid & (index.groups == g)])
+                 for g in range(n)]
+    dissolved = [d for d in dissolved if not shapely.is_empty(d)]
+    if len(dissolved) > 0:
+        covers = rasterize(((d, 1) for d in dissolved), out_shape=shape,
+                           transform=transform, fill=0,
+                           merge_alg=MergeAlg.add, dtype="uint8")
+        borders = rasterize(((b, 1) for b in shapely.boundary(dissolved)),
+                            out_shape=shape, transform=transform, fill=0,
+                            all_touched=True, dtype="uint8")
+        codes[(covers > 1) | (borders > 0)] = BORDER
+    return RegionRaster(codes, float(x0), float(y0), float(cell_size))
+
+def save_region_raster(lookup, outfile, crs, checksum, cols=["subregion"]):
+    """Save region lookup raster to GeoTIFF, tagged with source file hash and
+    encoded region property columns"""
+    with rasterio.open(outfile, "w", driver="GTiff",
+                       height=lookup.codes.shape[0],
+                       width=lookup.codes.shape[1], count=1, dtype="uint8",
+                       crs=crs, compress="deflate",
+                       transform=from_origin(lookup.x0, lookup.y0,
+                                             lookup.cell_size,
+                                             lookup.cell_size)) as dst:
+        dst.write(lookup.codes, 1)
+        dst.update_tags(version=str(RASTER_VERSION), source_hash=checksum,
+                        columns=",".join(cols))
+
+def lookup_regions(lookup, x, y):
+    """Get region value codes of points from lookup raster, or -1 for points
+    that need exact region geometries and -2 for points outside of all
+    regions"""
+    with np.errstate(invalid="ignore"):
+        col = np.floor((x - lookup.x0) / lookup.cell_size)
+        row = np.floor((lookup.y0 - y) / lookup.cell_size)
+    inside = (col >= 0) & (col < lookup.codes.shape[1]) & \
+             (row >= 0) & (row < lookup.codes.shape[0])
+    codes = np.zeros(len(x), dtype=np.uint8)
+    codes[inside] = lookup.codes[row[inside].astype(np.intp),
+                                 col[inside].astype(np.intp)]
+    idx = codes.astype(np.int64) - 1
+    idx[codes == BORDER] = -1
+    idx[inside & (codes == OUTSIDE)] = -2
+    idx[~inside] = -1
+    return idx
+
 def get_nearest_polygon(gdfA,
                         gdfB,
                         gdfB_cols=["subregion"],
-                        distance=100000.0):
-    """Return given properties of nearest polygon in Y to geometry in X"""  
-    
-    A = np.array(list(gdfA.geometry.centroid.apply(lambda x: (x.x, x.y))))
-    # B = [np.array(geom.boundary.coords) for geom in gdfB.geometry.to_list()]
+                        distance=100000.0,
+                        lookup=None):
+    """Return given properties of polygon in Y containing, or otherwise
+    nearest to, the centroid of each geometry in X"""
+    index = get_region_index(gdfB, gdfB_cols)
+    values = get_region_values(gdfA.geometry.centroid.values, index,
+                               gdfB_cols, distance, lookup)
+    gdf = gdfA.copy()
+    for c in gdfB_cols:
+        gdf[c] = values[c]
+    return gdf
 
-    B=[]    
-    for geom in gdfB.geometry.to_list():
-        try:
-            g = np.array(geom.boundary.coords)
-        except:
-            g = np.array(geom.boundary.geoms[0].coords)
-        B.append(g)
+def get_region_values(A, index, cols=["subregion"], distance=100000.0,
+                      lookup=None):
+    """Get given properties of region containing, or otherwise nearest to,
+    each point"""
+    idx = np.full(len(A), -1, dtype=np.int64)
 
-    
-    B_ix = tuple(itertools.chain.from_iterable(
-        [itertools.repeat(i, x) for i, x in enumerate(list(map(len, B)))]))
-    B = np.concatenate(B)
-    ckd_tree = cKDTree(B)
-    
-    dist, idx = ckd_tree.query(A, k=1)
-    idx = itemgetter(*idx)(B_ix)
-    
-    gdf = pd.concat(
-        [gdfA, gdfB.loc[idx, gdfB_cols].reset_index(drop=True),
-         pd.Series(dist, name="dist")], axis=1)
-    
-    gdf.loc[gdf["dist"]>=distance, "subregion"] = "Unknown"
-    
-    gdf = gdf.drop(columns=["dist"])   
-    return gdf    
+    # Classify centroids in region interior cells of lookup raster, taking
+    # the first region with each region value code
+    if lookup is not None:
+        idx = lookup_regions(lookup, shapely.get_x(A), shapely.get_y(A))
+        first = np.unique(index.groups, return_index=True)[1]
+        idx[idx >= 0] = first[idx[idx >= 0]]
+    todo = np.flatnonzero(idx == -1)
+
+    # Bulk point-in-polygon, taking the first region on shared boundaries
+    a, b = index.tree.query(A[todo], predicate="intersects")
+    a = todo[a]
+    first = np.unique(a, return_index=True)[1]
+    idx[a[first]] = b[first]
+
+    # Nearest region within distance threshold for the remainder
+    rest = np.flatnonzero(idx < 0)
+    if len(rest) > 0:
+        a, b = index.tree.query(A[rest], predicate="dwithin",
+                                distance=distance)
+        dist = shapely.distance(A[rest[a]], index.geoms[b])
+        near = dist < distance
+        a, b, dist = a[near], b[near], dist[near]
+        order = np.lexsort((b, dist, a))
+        first = order[np.unique(a[order], return_index=True)[1]]
+        idx[rest[a[first]]] = b[first]
+
+    found = idx >= 0
+    values = {}
+    for c in cols:
+        values[c] = np.full(len(A), "Unknown", dtype=object)
+        values[c][found] = index.values[c][idx[found]]
+    return values
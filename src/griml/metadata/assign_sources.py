@@ -1,6 +1,9 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import numpy as np
+import pandas as pd
+
 __all__ = ["assign_sources"]
 
 def assign_sources(gdf, 
@@ -20,34 +23,48 @@ def assign_sources(gdf,
     gdf : geopandas.GeoDataFrame
         Vectors with assigned sources
     """
-    all_src=[]
-    num_src=[]
-    for idx, i in gdf.iterrows():
-        idl = i[col_names[0]]
-        g = gdf[gdf[col_names[0]] == idl]
-        source = list(set(list(gdf[col_names[1]])))
-        satellites=""
-        if len(source)==1:
-            satellites = satellites.join(source)
-            num = 1
-        elif len(source)==2:
-            satellites = satellites.join(source[0]+", "+source[1])
-            num = 2
-        elif len(source)==3:
-            satellites = satellites.join(source[0]+", "+source[1]+", "+source[2])
-            num = 3
-        else:
-            print("Unknown number of sources detected")
-            print(source)
-            satellites=None
-            num=None
-        all_src.append(satellites)
-        num_src.append(num)
-
-    gdf["all_src"]=all_src
-    gdf["num_src"]=num_src
+    lake, src = col_names
+    all_src, num_src = get_sources(gdf[lake], gdf[src])
+    gdf["all_src"] = all_src
+    gdf["num_src"] = num_src
     return gdf
 
+def get_sources(lake_values, src_values):
+    """Get sorted, comma-separated source list and number of sources of the
+    lake of each vector, from lake ids and individual sources"""
+    lake_codes, lakes = pd.factorize(lake_values)
+    src_codes, sources = pd.factorize(src_values, sort=True)
+    valid = (lake_codes >= 0) & (src_codes >= 0)
+
+    if len(sources) < 64:
+        # Combine sources of each lake into a bitmask, ordered by source name
+        masks = np.zeros(len(lakes), dtype=np.int64)
+        np.bitwise_or.at(masks, lake_codes[valid],
+                         np.left_shift(1, src_codes[valid]).astype(np.int64))
+
+        # Look up source list of each distinct bitmask
+        combos, inverse = np.unique(masks, return_inverse=True)
+        bits = (combos[:,None] >> np.arange(len(sources))) & 1
+        names = np.array([", ".join(sources[b.astype(bool)]) for b in bits],
+                         dtype=object)
+        all_src = names[inverse]
+        num_src = bits.sum(axis=1)[inverse]
+
+    else:
+        # Or join sorted, de-duplicated sources of each lake
+        pairs = pd.DataFrame({"lake": lake_codes[valid],
+                              "src": sources[src_codes[valid]]})
+        pairs = pairs.drop_duplicates().sort_values(["lake", "src"])
+        grouped = pairs.groupby("lake")["src"]
+        all_src = grouped.agg(", ".join).reindex(range(len(lakes))).values
+        num_src = grouped.size().reindex(range(len(lakes)), fill_value=0).values
+
+    # Broadcast back to each lake geometry
+    all_src = np.append(all_src, None).astype(object)[lake_codes]
+    num_src = np.append(num_src, 0)[lake_codes]
+    all_src[num_src==0] = None
+    return all_src, num_src
+
 def _get_indices(mylist, value):
     """Get indices for value in list"""
     return[i for i, x in enumerate(mylist) if x==value]
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json, os, sqlite3
+from contextlib import closing
+from pathlib import Path
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from griml.load import load
+from griml.metadata.assign_id import get_overlap_graph
+
+__all__ = ["LakeRegistry"]
+
+class LakeRegistry:
+    """Persistent registry of lake IDs across inventory years
+
+    The registry is a directory holding the canonical lake footprints (an
+    append-only GeoPackage layer with a spatial index, one or more footprint
+    pieces per lake), the next free lake ID and the IDs merged into other
+    lakes, and a log of matched, new, merged and split lakes. Adding an
+    inventory only reads the footprints within the bounds of its lakes,
+    through the footprint spatial index, and appends the parts of its lakes
+    not already covered, rather than re-numbering all years
+
+    Parameters
+    ----------
+    path : str
+        Registry directory, created if it does not exist
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.footprint_file = str(self.path.joinpath("footprints.gpkg"))
+        self.state_file = str(self.path.joinpath("registry.json"))
+        self.log_file = str(self.path.joinpath("log.csv"))
+
+        if os.path.isfile(self.state_file):
+            with open(self.state_file) as f:
+                state = json.load(f)
+            self.next_id = state["next_id"]
+            self.aliases = {int(k): v for k, v in state["aliases"].items()}
+        else:
+            self.next_id = 1
+            self.aliases = {}
+
+    def add(self, gdf, label=None, col_name="lake_id"):
+        """Assign registry lake IDs to inventory, and register its lakes
+
+        Overlapping geometries within the inventory are grouped into lakes,
+        as in assign_id, and matched to registered lakes whose footprints
+        they intersect (beyond touching). Lakes matching no registered lake
+        are issued new IDs. Lakes bridging several registered lakes merge
+        them into the lowest ID, and registered lakes matched by several
+        separate lakes keep their ID for all of them (a split)
+
+        Parameters
+        ----------
+        gdf : geopandas.GeoDataFrame
+            Inventory to assign lake IDs to
+        label : str, optional
+            Label of inventory (such as its year) for the registry log
+        col_name : str
+            Column name to assign ID to
+
+        Returns
+        -------
+        gdf : geopandas.GeoDataFrame
+            Inventory with assigned lake IDs
+        """
+        gdf = load(gdf)
+        label = "" if label is None else str(label)
+        geoms = gdf.geometry.values
+
+        # Group overlapping geometries within inventory
+        n, comp = connected_components(get_overlap_graph(gdf.geometry))
+
+        # Match against registered footprints within bounds of each lake
+        bounds = pd.DataFrame(shapely.bounds(geoms),
+                              columns=["minx", "miny", "maxx", "maxy"])
+        bounds = bounds.groupby(comp).agg({"minx": "min", "miny": "min",
+                                           "maxx": "max", "maxy": "max"})
+        fp = self.query_footprints(bounds.dropna().to_numpy())
+        fp_geoms = fp.geometry.values
+        fp_ids = self.resolve(fp["lake_id"].to_numpy())
+        a, b = shapely.STRtree(fp_geoms).query(geoms, predicate="intersects")
+        keep = ~shapely.touches(geoms[a], fp_geoms[b])
+        a, b = a[keep], b[keep]
+        covered = np.zeros(len(gdf), dtype=bool)
+        covered[a[shapely.covers(fp_geoms[b], geoms[a])]] = True
+
+        # Link inventory lakes and registered lakes they match
+        lake_codes, lakes = pd.factorize(fp_ids[b])
+        m = len(lakes)
+        graph = csr_matrix((np.ones(len(a), dtype=np.int8),
+                            (comp[a], n + lake_codes)), shape=(n+m, n+m))
+        k, group = connected_components(graph, directed=False)
+
+        # Assign each group the lowest registered lake ID, or a new ID
+        group_ids = np.zeros(k, dtype=np.int64)
+        if m > 0:
+            lowest = pd.Series(np.asarray(lakes)).groupby(group[n:]).min()
+            group_ids[lowest.index] = lowest.values
+        used = np.unique(group[:n])
+        new = used[group_ids[used] == 0]
+        group_ids[new] = self.next_id + np.arange(len(new))
+        self.next_id += len(new)
+        ids = group_ids[group[comp]]
+
+        # Log merged, split and new lakes
+        log = []
+        if m > 0:
+            for g, members in pd.Series(np.asarray(lakes)).groupby(
+                    group[n:]):
+                if len(members) > 1:
+                    self.merge(members[members != group_ids[g]],
+                               group_ids[g])
+                    log.append([label, "merge", group_ids[g],
+                                " ".join(str(i) for i in sorted(members))])
+            pairs = np.unique(np.column_stack([lake_codes, comp[a]]), axis=0)
+            codes, parts = np.unique(pairs[:,0], return_counts=True)
+            for c, p in zip(codes[parts > 1], parts[parts > 1]):
+                log.append([label, "split", group_ids[group[n+c]], str(p)])
+        log.extend([label, "new", i, ""] for i in group_ids[new])
+
+        # Save issued IDs before footprints, so IDs are never re-issued
+        self.save()
+        self.write_log(log)
+
+        # Register footprints of geometries not already covered
+        append = ~covered & ~(shapely.is_missing(geoms) |
+                              shapely.is_empty(geoms))
+        if append.any():
+            pieces = gpd.GeoDataFrame({"lake_id": ids[append]},
+                                      geometry=geoms[append], crs=gdf.crs)
+            pieces.to_file(self.footprint_file, layer="footprints",
+                           mode="a" if os.path.isfile(self.footprint_file)
+                           else "w")
+
+        gdf[col_name] = ids
+        return gdf
+
+    def resolve(self, ids):
+        """Get current lake IDs of registered IDs, following merges
+
+        Parameters
+        ----------
+        ids : numpy.ndarray
+            Registered lake IDs
+
+        Returns
+        -------
+        ids : numpy.ndarray
+            Current lake IDs
+        """
+        ids = np.asarray(ids, dtype=np.int64).copy()
+        if len(self.aliases) == 0:
+            return ids
+        old = np.array(sorted(self.aliases), dtype=np.int64)
+        new = np.array([self.aliases[i] for i in old], dtype=np.int64)
+        pos = np.minimum(np.searchsorted(old, ids), len(old)-1)
+        hit = old[pos] == ids
+        ids[hit] = new[pos[hit]]
+        return ids
+
+    def merge(self, ids, into):
+        """Record lake IDs as merged into another lake ID"""
+        ids = set(int(i) for i in ids)
+        for k, v in self.aliases.items():
+            if v in ids:
+                self.aliases[k] = int(into)
+        for i in ids:
+            self.aliases[i] = int(into)
+
+    def footprints(self):
+        """Get canonical footprint of each current lake
+
+        Returns
+        -------
+        gdf : geopandas.GeoDataFrame
+            Lake footprints, dissolved by current lake ID
+        """
+        fp = self.read_footprints()
+        fp["lake_id"] = self.resolve(fp["lake_id"].to_numpy())
+        return fp.dissolve(by="lake_id").reset_index()
+
+    def query_footprints(self, bounds):
+        """Read registered footprint pieces intersecting any of the given
+        bounding boxes (minx, miny, maxx, maxy), through the footprint
+        layer's R-tree spatial index"""
+        empty = gpd.GeoDataFrame({"lake_id": np.zeros(0, dtype=np.int64)},
+                                 geometry=[])
+        if len(bounds) == 0 or not os.path.isfile(self.footprint_file):
+            return empty
+
+        with closing(sqlite3.connect("file:" + self.footprint_file +
+                                     "?mode=ro", uri=True)) as con:
+            column = con.execute("SELECT column_name FROM "
+                                 "gpkg_geometry_columns WHERE table_name = "
+                                 "'footprints'").fetchone()[0]
+            con.execute("CREATE TEMP TABLE bounds "
+                        "(minx REAL, miny REAL, maxx REAL, maxy REAL)")
+            con.executemany("INSERT INTO bounds VALUES (?, ?, ?, ?)",
+                            np.asarray(bounds, dtype=float).tolist())
+            fids = [r[0] for r in con.execute(
+                "SELECT DISTINCT r.id FROM bounds b CROSS JOIN "
+                "\"rtree_footprints_" + column + "\" r WHERE "
+                "r.minx <= b.maxx AND r.maxx >= b.minx AND "
+                "r.miny <= b.maxy AND r.maxy >= b.miny")]
+
+        if len(fids) == 0:
+            return empty
+        return gpd.read_file(self.footprint_file, layer="footprints",
+                             fids=np.sort(fids))
+
+    def read_footprints(self, bbox=None):
+        """Read registered footprint pieces, optionally within bounds"""
+        if not os.path.isfile(self.footprint_file):
+            return gpd.GeoDataFrame({"lake_id": np.zeros(0, dtype=np.int64)},
+                                    geometry=[])
+        return load(self.footprint_file,
+                    bbox=None if bbox is None else tuple(bbox))
+
+    def save(self):
+        """Save next free lake ID and merged lake IDs"""
+        tmpfile = self.state_file + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump({"version": 1, "next_id": int(self.next_id),
+                       "aliases": {str(k): int(v) for k, v in
+                                   self.aliases.items()}}, f)
+        os.replace(tmpfile, self.state_file)
+
+    def write_log(self, rows):
+        """Append rows of lake events to registry log"""
+        if len(rows) == 0:
+            return
+        log = pd.DataFrame(rows, columns=["label", "event", "lake_id",
+                                          "detail"])
+        log.to_csv(self.log_file, mode="a", index=False,
+                   header=not os.path.isfile(self.log_file))
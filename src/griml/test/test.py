@@ -4,12 +4,27 @@
 import unittest, tempfile, rasterio, os
 from rasterio.transform import from_origin
 import geopandas as gpd
+import pandas as pd
 from shapely.geometry import Point, Polygon
 import numpy as np
 from griml.convert.convert import convert
 from griml.filter.filter_vectors import filter_vectors
+from griml.filter.filter_area import filter_area
+from griml.filter.filter_margin import filter_margin, MarginFilter
+from griml.filter.filter_pipeline import FilterPipeline
+from griml.filter.split_margin import split_margin
 from griml.merge.merge_vectors import merge_vectors
-from griml.metadata.add_metadata import add_metadata
+from griml.metadata.add_metadata import add_metadata, add_metadata_series
+from griml.metadata.assign_id import assign_id
+from griml.metadata.assign_sources import assign_sources
+from griml.metadata.assign_certainty import assign_certainty
+from griml.metadata.assign_names import assign_names, get_placename_index
+from griml.metadata.assign_regions import assign_regions, get_region_index, \
+    get_region_raster
+from griml.metadata.lake_registry import LakeRegistry
+from griml.load import load, write, cache_info, clear_cache, set_cache_budget
+from griml.convert.raster_to_vector import raster_to_vector, \
+    get_band_vectors, get_bands_vectors
 
 class TestGrIML(unittest.TestCase):
     '''Unittest for the GrIML post-processing workflow'''
@@ -96,6 +111,138 @@ class TestGrIML(unittest.TestCase):
         self.assertIsInstance(out, list)
         self.assertIn('geometry', out[0].columns)
 
+    def test_convert_workers(self):
+        '''Test parallel raster to vector conversion over multiple files'''
+        proj = 'EPSG:3413'
+        band_info = [{'b_number': 1, 'method': 'VIS', 'source': 'S2'}]
+        paths = [os.path.join(self.temp_dir.name, f'sample_raster_{i}.tif')
+                 for i in range(2)]
+        for p in paths:
+            self.create_sample_raster(p)
+        missing = os.path.join(self.temp_dir.name, 'missing.tif')
+
+        out = convert([paths[0], missing, paths[1]], proj, band_info,
+                      '20170701', '20170831', outdir=self.temp_dir.name,
+                      workers=2)
+        self.assertEqual(len(out), 3)
+        self.assertIsNone(out[1])
+        self.assertTrue(out[0].endswith('sample_raster_0.gpkg'))
+        self.assertTrue(os.path.isfile(out[2]))
+
+    def test_convert_windowed(self):
+        '''Test windowed raster to vector conversion matches whole band'''
+        # Create synthetic tiled raster with features crossing tile seams
+        temp_raster_path = os.path.join(self.temp_dir.name, 'sample_tiled.tif')
+        data = np.zeros((1, 64, 64), dtype='uint8')
+        data[0, 2:60, 10:14] = 1
+        data[0, 30:34, 2:62] = 1
+        data[0, 40:44, 40:44] = 1
+        data[0, 15:17, 15:17] = 1
+        with rasterio.open(
+            temp_raster_path, 'w',
+            driver='GTiff', height=64, width=64,
+            count=1, dtype='uint8', crs='EPSG:3413',
+            transform=from_origin(0, 640, 10, 10),
+            tiled=True, blockxsize=16, blockysize=16
+        ) as dst:
+            dst.write(data)
+
+        whole = gpd.GeoSeries(get_band_vectors(temp_raster_path, 1))
+        for halo in [0, 8]:
+            windowed = gpd.GeoSeries(get_band_vectors(temp_raster_path, 1,
+                                                      window_size=16, halo=halo))
+            self.assertEqual(len(windowed), len(whole))
+            self.assertAlmostEqual(windowed.union_all().symmetric_difference(
+                whole.union_all()).area, 0)
+            self.assertEqual(sorted(windowed.area), sorted(whole.area))
+
+    def test_convert_multiband(self):
+        '''Test single-read multi-band conversion matches per-band conversion'''
+        temp_raster_path = os.path.join(self.temp_dir.name, 'sample_bands.tif')
+        data = np.zeros((3, 20, 20), dtype='uint8')
+        data[0, 2:5, 2:5] = 1
+        data[1, 2:5, 2:5] = 1
+        data[1, 10:15, 10:12] = 1
+        data[2, 0:20, 8:9] = 1
+        with rasterio.open(
+            temp_raster_path, 'w',
+            driver='GTiff', height=20, width=20,
+            count=3, dtype='uint8', crs='EPSG:3413',
+            transform=from_origin(0, 200, 10, 10)
+        ) as dst:
+            dst.write(data)
+
+        for window_size in [None, 8]:
+            bands = get_bands_vectors(temp_raster_path, [3, 1, 2],
+                                      window_size=window_size)
+            self.assertEqual([len(b) for b in bands], [1, 1, 2])
+            for b, polys in zip([3, 1, 2], bands):
+                single = get_band_vectors(temp_raster_path, b)
+                self.assertEqual(sorted(p.area for p in polys),
+                                 sorted(p.area for p in single))
+
+    def test_convert_min_area(self):
+        '''Test raster-level area prefilter matches vector area filter'''
+        proj = 'EPSG:3413'
+        band_info = [{'b_number': 1, 'method': 'VIS', 'source': 'S2'}]
+        temp_raster_path = os.path.join(self.temp_dir.name, 'sample_blobs.tif')
+        data = np.zeros((1, 40, 40), dtype='uint8')
+        data[0, 1:3, 1:3] = 1       # 4 pixels
+        data[0, 10:15, 10:15] = 1   # 25 pixels
+        data[0, 20:40, 30:31] = 1   # 20 pixels, crossing windows
+        data[0, 30:32, 5:7] = 1     # 4 pixels
+        with rasterio.open(
+            temp_raster_path, 'w',
+            driver='GTiff', height=40, width=40,
+            count=1, dtype='uint8', crs='EPSG:3413',
+            transform=from_origin(0, 400, 10, 10),
+            tiled=True, blockxsize=16, blockysize=16
+        ) as dst:
+            dst.write(data)
+
+        # 20 pixels of 10x10 m
+        min_area = 0.002
+        ref = filter_area(raster_to_vector(temp_raster_path, proj, band_info,
+                                           '20170701', '20170831'), min_area)
+        for window_size in [None, 16]:
+            out = raster_to_vector(temp_raster_path, proj, band_info,
+                                   '20170701', '20170831',
+                                   window_size=window_size, halo=0,
+                                   min_area=min_area)
+            self.assertEqual(sorted(out.area), sorted(ref.area))
+
+    def test_convert_margin(self):
+        '''Test raster-level margin masking matches vector margin filter'''
+        proj = 'EPSG:3413'
+        band_info = [{'b_number': 1, 'method': 'VIS', 'source': 'S2'}]
+        temp_raster_path = os.path.join(self.temp_dir.name, 'sample_margin.tif')
+        data = np.zeros((1, 40, 40), dtype='uint8')
+        data[0, 2:6, 2:6] = 1       # inside margin buffer
+        data[0, 8:12, 20:24] = 1    # partly inside margin buffer
+        data[0, 5:35, 30:32] = 1    # crossing margin buffer and windows
+        data[0, 25:30, 5:10] = 1    # outside margin buffer
+        with rasterio.open(
+            temp_raster_path, 'w',
+            driver='GTiff', height=40, width=40,
+            count=1, dtype='uint8', crs='EPSG:3413',
+            transform=from_origin(0, 400, 10, 10),
+            tiled=True, blockxsize=16, blockysize=16
+        ) as dst:
+            dst.write(data)
+        buffer = gpd.GeoDataFrame(
+            geometry=[Polygon([(5, 395), (305, 395), (305, 285), (5, 285)])],
+            crs='EPSG:3413')
+
+        ref = filter_margin(raster_to_vector(temp_raster_path, proj, band_info,
+                                             '20170701', '20170831'), buffer)
+        self.assertEqual(len(ref), 3)
+        for window_size in [None, 16]:
+            out = raster_to_vector(temp_raster_path, proj, band_info,
+                                   '20170701', '20170831',
+                                   window_size=window_size, halo=0,
+                                   margin_buffer=buffer)
+            self.assertEqual(sorted(out.area), sorted(ref.area))
+
     def test_filter(self):
         '''Test vector filtering'''
         # Create synthetic shapefiles
@@ -108,6 +255,90 @@ class TestGrIML(unittest.TestCase):
         out = filter_vectors([temp_filter_path], temp_icemask_path)
         self.assertTrue(True)
 
+        # Filter in worker processes, which write outputs and return counts
+        outdir = os.path.join(self.temp_dir.name, 'filtered')
+        os.makedirs(outdir)
+        out = filter_vectors([temp_filter_path], temp_icemask_path,
+                             min_area=0)
+        summaries = filter_vectors([temp_filter_path, load(temp_filter_path)],
+                                   temp_icemask_path, min_area=0,
+                                   outdir=outdir, workers=2)
+        self.assertEqual(len(summaries), 2)
+        for summary in summaries:
+            self.assertEqual(summary['input'], 5)
+            self.assertEqual(summary['margin'], out[0].shape[0])
+            self.assertEqual(load(summary['outfile']).shape[0],
+                             out[0].shape[0])
+
+    def test_margin_filter(self):
+        '''Test margin filter with a multi-part margin buffer'''
+        margin = gpd.GeoDataFrame(geometry=[Polygon([(0,0),(4,0),(4,4),(0,4)])
+                                            .union(Polygon([(6,0),(9,0),(9,4),(6,4)]))],
+                                  crs='EPSG:3413')
+        lakes = gpd.GeoDataFrame({'id': range(3)},
+                                 geometry=[Point(3.5, 2).buffer(1),
+                                           Point(5, 2).buffer(0.5),
+                                           Point(20, 2).buffer(1)],
+                                 crs='EPSG:3413')
+        margin_filter = MarginFilter(margin)
+        self.assertEqual(len(margin_filter.geoms), 2)
+        self.assertEqual(list(margin_filter.intersects(lakes.geometry)),
+                         [True, False, False])
+        self.assertEqual(list(filter_margin(lakes, margin_filter)['id']), [0])
+        for cell_size in [None, 2]:
+            self.assertEqual(list(filter_margin(lakes, margin.geometry,
+                                                cell_size)['id']), [0])
+
+        # Margin split into grid pieces, cached next to the margin file
+        infile = os.path.join(self.temp_dir.name, 'split_margin.gpkg')
+        margin.to_file(infile)
+        pieces = split_margin(infile, cell_size=2)
+        self.assertEqual(len(pieces), 8)
+        self.assertAlmostEqual(pieces.area.sum(), margin.area.sum())
+        self.assertEqual(len([f for f in os.listdir(self.temp_dir.name)
+                              if f.endswith('.split.parquet')]), 1)
+
+        # Pieces are held in the shared cache, and cleared with it
+        clear_cache(infile)
+        entries = cache_info()['entries']
+        split_margin(infile, cell_size=2)
+        self.assertEqual(cache_info()['entries'], entries + 1)
+        clear_cache(infile)
+        self.assertEqual(cache_info()['entries'], entries)
+        self.assertEqual(list(filter_margin(lakes, infile, 2)['id']), [0])
+
+    def test_filter_pipeline(self):
+        '''Test lazy filter pipeline ordering and report'''
+        lakes = gpd.GeoDataFrame({'id': range(4),
+                                  'source': ['S1', 'S2', 'S2', 'S2']},
+                                 geometry=[Point(0, 0).buffer(500),
+                                           Point(0, 0).buffer(500),
+                                           Point(0, 0).buffer(50),
+                                           Point(9000, 0).buffer(500)],
+                                 crs='EPSG:3413')
+        margin = gpd.GeoDataFrame(geometry=[Point(0, 0).buffer(1000)],
+                                  crs='EPSG:3413')
+        pipeline = FilterPipeline().margin(margin).area(0.05) \
+            .attribute('source', '==', 'S2')
+        out = pipeline.apply(lakes, verbose=False)
+        self.assertEqual(list(out['id']), [1])
+
+        # Cheapest predicates first, each testing only rows kept so far
+        report = out.attrs['filter_report']
+        self.assertEqual([r['predicate'] for r in report],
+                         ['source ==', 'area', 'margin'])
+        self.assertEqual([r['tested'] for r in report], [4, 3, 2])
+        self.assertEqual([r['kept'] for r in report], [3, 2, 1])
+
+        # Custom predicates get the column values of candidate rows only
+        seen = []
+        pipeline = FilterPipeline().attribute('source', 'in', ['S2']) \
+            .add('id', lambda rows: seen.append(list(rows['id'])) or
+                 rows['id'] > 1, 5)
+        out = pipeline.apply(lakes, verbose=False)
+        self.assertEqual(seen, [[1, 2, 3]])
+        self.assertEqual(list(out['id']), [2, 3])
+
     def test_merge(self):
         '''Test vector merging'''
         # Create two synthetic shapefiles for merging
@@ -121,6 +352,46 @@ class TestGrIML(unittest.TestCase):
         self.assertIsInstance(out, gpd.GeoDataFrame)
         self.assertIn('geometry', out.columns)
 
+        # Merged columns are categorical, with area and length measured
+        self.assertEqual(out.shape[0], 10)
+        self.assertEqual(str(out['source'].dtype), 'category')
+        self.assertEqual(list(out.index), list(range(1, 6))*2)
+        np.testing.assert_allclose(out['area_sqkm'], 1e-6)
+
+        # Stream inputs one at a time to a single layer, with global row IDs
+        outfile = os.path.join(self.temp_dir.name, 'sample_merged.gpkg')
+        self.assertEqual(merge_vectors([temp_merge_path1, temp_merge_path2],
+                                       outfile=outfile, batch_size=1),
+                         outfile)
+        streamed = load(outfile)
+        self.assertEqual(list(streamed['row_id']), list(range(1, 11)))
+        self.assertEqual(list(streamed['source']), list(out['source']))
+
+        # Stream an empty first input, then more than 127 distinct dates
+        empty = os.path.join(self.temp_dir.name, 'sample_merge_empty.gpkg')
+        dates = os.path.join(self.temp_dir.name, 'sample_merge_dates.gpkg')
+        gpd.GeoDataFrame({'method': [], 'source': [], 'startdate': [],
+                          'enddate': []}, geometry=[],
+                         crs='EPSG:3413').to_file(empty)
+        gpd.GeoDataFrame({'method': 'VIS', 'source': 'S2',
+                          'startdate': [str(20170000+i) for i in range(200)],
+                          'enddate': '20170831'},
+                         geometry=[Point(i, 0).buffer(0.4) for i in range(200)],
+                         crs='EPSG:3413').to_file(dates)
+        for ext in ['gpkg', 'parquet']:
+            outfile = os.path.join(self.temp_dir.name, 'sample_streamed.' + ext)
+            streamed = merge_vectors([empty, temp_merge_path1, dates],
+                                     outfile=outfile, batch_size=1,
+                                     return_merged=True)
+            self.assertEqual(streamed.shape[0], 205)
+            self.assertEqual(list(streamed['startdate'][-200:]),
+                             [str(20170000+i) for i in range(200)])
+
+        # Formats written all at once are not streamed to
+        with self.assertRaises(ValueError):
+            merge_vectors([temp_merge_path1], batch_size=1,
+                          outfile=os.path.join(self.temp_dir.name, 'out.shp'))
+
     def test_metadata(self):
         '''Test metadata population'''
         # Create synthetic shapefiles for metadata function
@@ -135,6 +406,243 @@ class TestGrIML(unittest.TestCase):
         out = add_metadata(temp_metadata_path1, temp_metadata_path2, temp_metadata_path3)
         self.assertTrue(True)
 
+        # Fused and step-by-step metadata are the same
+        steps = add_metadata(temp_metadata_path1, temp_metadata_path2,
+                             temp_metadata_path3, fused=False)
+        for c in ['lake_id', 'all_src', 'num_src', 'certainty', 'subregion',
+                  'placename']:
+            self.assertTrue(out[c].equals(steps[c]))
+        self.assertIn('Regions', out.attrs['timings'])
+
+    def test_metadata_series(self):
+        '''Test metadata population over a series of inventories'''
+        inventory = os.path.join(self.temp_dir.name, 'series_iml.shp')
+        names = os.path.join(self.temp_dir.name, 'series_names.shp')
+        regions = os.path.join(self.temp_dir.name, 'series_regions.shp')
+        self.create_sample_polyfile(inventory)
+        self.create_sample_pointfile(names)
+        self.create_sample_polyfile(regions)
+        expected = add_metadata(inventory, names, regions)
+
+        outfiles = [os.path.join(self.temp_dir.name, 'series_'+str(y)+'.gpkg')
+                    for y in [2016, 2017]]
+        out = add_metadata_series([inventory, load(inventory)], names,
+                                  regions, outfiles, workers=2)
+        self.assertEqual(out, outfiles)
+        for o in outfiles:
+            g = load(o)
+            self.assertEqual(list(g['lake_id']), list(expected['lake_id']))
+            self.assertEqual(list(g['placename']),
+                             list(expected['placename']))
+
+    def test_write(self):
+        '''Test streaming vector writer'''
+        def chunks():
+            for i in range(3):
+                gdf = gpd.GeoDataFrame(
+                    {'method': 'VIS', 'row_id': [2*i+1, 2*i+2]},
+                    geometry=[Point(i, 0).buffer(0.4), Point(i, 1).buffer(0.4)],
+                    crs='EPSG:3413')
+                yield gdf
+
+        for ext in ['gpkg', 'parquet', 'geoparquet']:
+            outfile = os.path.join(self.temp_dir.name, 'sample_write.' + ext)
+            self.assertEqual(write(chunks(), outfile), 6)
+            self.assertIsNone(write(chunks(), outfile))
+            self.assertEqual(write(chunks(), outfile, overwrite=True), 6)
+
+            out = load(outfile)
+            self.assertEqual(list(out['row_id']), [1, 2, 3, 4, 5, 6])
+            self.assertEqual(out.crs, 'EPSG:3413')
+
+            # Read with column projection and bbox filter
+            out = load(outfile, columns=['row_id'], bbox=(-0.5, -0.5, 0.5, 1.5))
+            self.assertEqual(list(out.columns), ['row_id', 'geometry'])
+            self.assertEqual(list(out['row_id']), [1, 2])
+            self.assertTrue(os.path.isfile(outfile))
+
+        # Bbox-filtered read of GeoParquet without a bounding box column
+        plain = os.path.join(self.temp_dir.name, 'sample_plain.parquet')
+        pd.concat(list(chunks())).to_parquet(plain)
+        out = load(plain, columns=['row_id'], bbox=(-0.5, -0.5, 0.5, 1.5))
+        self.assertEqual(list(out['row_id']), [1, 2])
+        os.remove(plain)
+        self.assertEqual(sorted(os.listdir(self.temp_dir.name)),
+                         ['sample_write.geoparquet', 'sample_write.gpkg',
+                          'sample_write.parquet'])
+
+    def test_load_cache(self):
+        '''Test cached loading of reference datasets'''
+        temp_path = os.path.join(self.temp_dir.name, 'sample_reference.gpkg')
+        self.create_sample_polyfile(temp_path)
+        clear_cache()
+        info = cache_info()
+
+        a = load(temp_path, cache=True)
+        a['lake_id'] = 0
+        b = load(temp_path, cache=True)
+        self.assertEqual(cache_info()['hits'], info['hits'] + 1)
+        self.assertEqual(list(b['lake_id']), [1, 1, 2, 3, 2])
+
+        # Changed files are re-read and replace the stale entry
+        self.create_sample_polyfile(temp_path, side_length=2.0)
+        os.utime(temp_path, ns=(0, 0))
+        self.assertEqual(load(temp_path, cache=True).area[0], 4.0)
+        self.assertEqual(cache_info()['entries'], 1)
+
+        # Explicit invalidation and disabled cache
+        clear_cache(temp_path)
+        self.assertEqual(cache_info()['entries'], 0)
+        set_cache_budget(0)
+        load(temp_path, cache=True)
+        self.assertEqual(cache_info()['entries'], 0)
+        set_cache_budget(1024**3)
+
+    def test_assign_id(self):
+        '''Test lake ID assignment from overlapping geometries'''
+        # Two overlapping chains of squares and one isolated square
+        geoms = [Polygon([(x, y), (x+1, y), (x+1, y+1), (x, y+1)])
+                 for x, y in [(0, 0), (0.5, 0.5), (10, 10), (1, 1), (10.5, 10), (20, 20)]]
+        gdf = gpd.GeoDataFrame({'id': range(len(geoms))}, geometry=geoms,
+                               crs='EPSG:3413')
+
+        out = assign_id(gdf.copy()).set_index('id')['lake_id']
+        self.assertEqual(list(out.sort_index()), [1, 1, 2, 1, 2, 3])
+
+        # Tiles split both chains across seams, with the same IDs
+        for kwargs in [{'tile_size': 0.6}, {'tile_size': 0.6, 'workers': 2}]:
+            tiled = assign_id(gdf.copy(), **kwargs).set_index('id')['lake_id']
+            self.assertEqual(list(tiled.sort_index()), [1, 1, 2, 1, 2, 3])
+
+    def test_assign_sources(self):
+        '''Test source assignment per lake'''
+        gdf = gpd.GeoDataFrame({'lake_id': [1, 1, 2, 3, 2, 2],
+                                'source': ['S2', 'S1', 'ARCTICDEM', 'S2', 'S1', 'S1']},
+                               geometry=[Point(0, 0)]*6, crs='EPSG:3413')
+        out = assign_sources(gdf)
+        self.assertEqual(list(out['all_src']), ['S1, S2', 'S1, S2', 'ARCTICDEM, S1',
+                                                'S2', 'ARCTICDEM, S1', 'ARCTICDEM, S1'])
+        self.assertEqual(list(out['num_src']), [2, 2, 2, 1, 2, 2])
+
+    def test_assign_certainty(self):
+        '''Test certainty scoring from source lists'''
+        gdf = gpd.GeoDataFrame({'all_src': ['S1, S2', 'ARCTICDEM, S1, S2', 'S2',
+                                            'LANDSAT, S2']},
+                               geometry=[Point(0, 0)]*4, crs='EPSG:3413')
+        out = assign_certainty(gdf.copy(), ['S1', 'S2', 'ARCTICDEM'],
+                               [0.298, 0.398, 0.304])
+        np.testing.assert_allclose(out['certainty'], [0.696, 1.0, 0.398, 0.398])
+
+        # User-supplied score table for new sources
+        out = assign_certainty(gdf.copy(), {'S2': 0.5, 'LANDSAT': 0.25})
+        np.testing.assert_allclose(out['certainty'], [0.5, 0.5, 0.5, 0.75])
+
+    def test_assign_names(self):
+        '''Test placename assignment with persistent placename index'''
+        names = gpd.GeoDataFrame({'New Greenl': [None, 'Nuuk'],
+                                  'Danish': ['Godthaab', 'Godthab']},
+                                 geometry=[Point(0, 0), Point(5000, 0)],
+                                 crs='EPSG:3413')
+        lakes = gpd.GeoDataFrame(geometry=[Point(100, 0).buffer(10),
+                                           Point(5100, 0).buffer(10),
+                                           Point(20000, 0).buffer(10)],
+                                 crs='EPSG:3413')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, 'names.gpkg')
+            names.to_file(infile)
+            out = assign_names(lakes.copy(), infile)
+            self.assertEqual(list(out['placename']),
+                             ['Godthaab', 'Nuuk', 'Unknown'])
+            self.assertTrue(os.path.isfile(infile + '.idx.npz'))
+
+            # Sidecar only holds plain arrays, read without unpickling
+            with np.load(infile + '.idx.npz', allow_pickle=False) as saved:
+                self.assertEqual(list(saved['names']), ['Godthaab', 'Nuuk'])
+
+            # Index is reused in process and from the sidecar file
+            self.assertIs(get_placename_index(infile),
+                          get_placename_index(infile))
+
+    def test_assign_regions(self):
+        '''Test region assignment by containment and nearest region'''
+        # Long straight shared edge, with few boundary vertices near lake 0
+        regions = gpd.GeoDataFrame({'subregion': ['NW', 'NE']},
+                                   geometry=[Polygon([(0, 0), (0, 100000),
+                                                      (-1000, 100000),
+                                                      (-1000, 0)]),
+                                             Polygon([(0, 0), (0, 100000),
+                                                      (100000, 100000),
+                                                      (100000, 0)])],
+                                   crs='EPSG:3413')
+        lakes = gpd.GeoDataFrame(geometry=[Point(-900, 50000).buffer(10),
+                                           Point(50000, 50000).buffer(10),
+                                           Point(120000, 50000).buffer(10),
+                                           Point(300000, 50000).buffer(10)],
+                                 crs='EPSG:3413')
+        out = assign_regions(lakes, regions)
+        self.assertEqual(list(out['subregion']),
+                         ['NW', 'NE', 'NE', 'Unknown'])
+
+        # Lookup raster, saved next to the regions file
+        with tempfile.TemporaryDirectory() as tmpdir:
+            infile = os.path.join(tmpdir, 'regions.gpkg')
+            regions.to_file(infile)
+            out = assign_regions(lakes, infile, cell_size=5000)
+            self.assertEqual(list(out['subregion']),
+                             ['NW', 'NE', 'NE', 'Unknown'])
+            self.assertTrue(os.path.isfile(infile + '.5000.0m.lookup.tif'))
+
+            # Sidecar of another cell size is rebuilt, not read
+            os.replace(infile + '.5000.0m.lookup.tif',
+                       infile + '.4000.0m.lookup.tif')
+            self.assertEqual(get_region_raster(infile, 4000).cell_size, 4000)
+            with rasterio.open(infile + '.4000.0m.lookup.tif') as src:
+                self.assertEqual(src.transform.a, 4000)
+
+        # Prebuilt region index, with lookup raster built from it
+        index = get_region_index(regions)
+        out = assign_regions(lakes, index, cell_size=5000)
+        self.assertEqual(list(out['subregion']),
+                         ['NW', 'NE', 'NE', 'Unknown'])
+
+        # Lookup raster encodes region values, for more than 255 regions
+        squares = gpd.GeoDataFrame(
+            {'subregion': [['SW', 'CW', 'NW'][i % 3] for i in range(400)]},
+            geometry=[Polygon([(x, y), (x+1000, y), (x+1000, y+1000),
+                               (x, y+1000)]) for x in range(0, 20000, 1000)
+                      for y in range(0, 20000, 1000)], crs='EPSG:3413')
+        centres = gpd.GeoDataFrame(geometry=squares.centroid.buffer(10),
+                                   crs='EPSG:3413')
+        out = assign_regions(centres, squares, cell_size=250)
+        self.assertEqual(list(out['subregion']), list(squares['subregion']))
+
+    def test_lake_registry(self):
+        '''Test lake ID registry across inventory years'''
+        year1 = gpd.GeoDataFrame(geometry=[Polygon([(0,0),(2,0),(2,2),(0,2)]),
+                                           Polygon([(1,1),(3,1),(3,3),(1,3)]),
+                                           Polygon([(5,0),(6,0),(6,1),(5,1)]),
+                                           Polygon([(8,0),(9,0),(9,1),(8,1)])],
+                                 crs='EPSG:3413')
+        year2 = gpd.GeoDataFrame(geometry=[Polygon([(5,0),(9,0),(9,1),(5,1)]),
+                                           Polygon([(20,0),(21,0),(21,1),(20,1)])],
+                                 crs='EPSG:3413')
+        path = os.path.join(self.temp_dir.name, 'registry')
+        out = LakeRegistry(path).add(year1.copy(), 2016)
+        self.assertEqual(list(out['lake_id']),
+                         list(assign_id(year1.copy())['lake_id']))
+
+        # Reopened registry merges bridged lakes and issues one new ID
+        registry = LakeRegistry(path)
+        out = registry.add(year2, 2017)
+        self.assertEqual(list(out['lake_id']), [2, 4])
+        self.assertEqual(list(registry.resolve([1, 2, 3])), [1, 2, 2])
+        self.assertEqual(len(registry.footprints()), 3)
+
+        # Only footprints within the bounds of each lake are read
+        fp = registry.query_footprints([[5, 0, 5.5, 0.5], [20, 0, 21, 1]])
+        self.assertEqual(sorted(fp['lake_id']), [2, 2, 4])
+        self.assertEqual(len(registry.query_footprints([[30, 0, 31, 1]])), 0)
+
 if __name__ == "__main__":  
     unittest.main()
 
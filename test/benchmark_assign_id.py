@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse, time
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy.sparse.csgraph import connected_components
+from griml.metadata.assign_id import assign_id
+
+def make_polygons(n, seed=42):
+    '''Generate n synthetic square lakes with a realistic amount of overlap'''
+    rng = np.random.default_rng(seed)
+    extent = np.sqrt(n) * 1000.0
+    x = rng.uniform(0, extent, n)
+    y = rng.uniform(0, extent, n)
+    half = rng.uniform(100, 600, n)
+    geoms = shapely.box(x - half, y - half, x + half, y + half)
+    return gpd.GeoDataFrame({"idx": np.arange(n)}, geometry=geoms,
+                            crs="EPSG:3413")
+
+def assign_id_dense(gdf, col_name="lake_id"):
+    '''Previous dense n x n overlap matrix implementation, for reference'''
+    geoms = gdf["geometry"].reset_index(drop=True)
+    overlap_matrix = geoms.apply(lambda x: geoms.overlaps(x)).values.astype(int)
+    n, ids = connected_components(overlap_matrix)
+    ids=ids+1
+    gdf[col_name]=ids
+    gdf = gdf.sort_values(col_name)
+    gdf.reset_index(inplace=True, drop=True)
+    return gdf
+
+def run(sizes, max_dense):
+    '''Time sparse and dense ID assignment for each number of polygons'''
+    print(f"{'n':>8} {'sparse (s)':>12} {'dense (s)':>12} {'identical':>10}")
+    for n in sizes:
+        gdf = make_polygons(n)
+
+        t0 = time.perf_counter()
+        sparse = assign_id(gdf.copy())
+        t_sparse = time.perf_counter() - t0
+
+        if n <= max_dense:
+            t0 = time.perf_counter()
+            dense = assign_id_dense(gdf.copy())
+            t_dense = f"{time.perf_counter() - t0:12.3f}"
+            same = str(sparse.set_index("idx")["lake_id"].sort_index().equals(
+                dense.set_index("idx")["lake_id"].sort_index()))
+        else:
+            t_dense = f"{'skipped':>12}"
+            same = "-"
+        print(f"{n:>8} {t_sparse:12.3f} {t_dense} {same:>10}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark assign_id")
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--max-dense", type=int, default=10000,
+                        help="Largest n to run the dense O(n^2) reference on")
+    args = parser.parse_args()
+    run(args.sizes, args.max_dense)
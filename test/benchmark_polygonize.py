@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import argparse, time
+import numpy as np
+from rasterio.features import shapes
+from rasterio.transform import from_origin
+from shapely.geometry import shape
+from griml.convert.raster_to_vector import polygonize
+
+def make_speckle(size, density=0.3, seed=42):
+    '''Generate a synthetic speckle raster of many small 1-valued blobs'''
+    rng = np.random.default_rng(seed)
+    return (rng.random((size, size)) < density).astype("uint8")
+
+def polygonize_dicts(image, transform):
+    '''Previous per-feature GeoJSON dict and shape() construction'''
+    mask = image == 1
+    results = (
+    {"properties": {"raster_val": v}, "geometry": s}
+    for i, (s, v)
+    in enumerate(
+        shapes(image,
+               mask=mask,
+               transform=transform)))
+
+    geoms = list(results)
+    polys = [shape(g["geometry"]) for g in geoms]
+    return polys
+
+def run(sizes, repeats):
+    '''Time per-feature and columnar polygon construction on speckle rasters'''
+    transform = from_origin(0, 0, 10, 10)
+    print(f"{'size':>6} {'features':>10} {'dicts (s)':>10} {'columnar (s)':>13}")
+    for size in sizes:
+        image = make_speckle(size)
+        t_dicts = []
+        t_columnar = []
+        for r in range(repeats):
+            t0 = time.perf_counter()
+            old = polygonize_dicts(image, transform)
+            t_dicts.append(time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            new = polygonize(image, transform)
+            t_columnar.append(time.perf_counter() - t0)
+
+        assert len(old) == len(new)
+        print(f"{size:>6} {len(new):>10} {min(t_dicts):10.3f} "
+              f"{min(t_columnar):13.3f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark polygonization")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 1000, 2000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    run(args.sizes, args.repeats)